@@ -0,0 +1,100 @@
+import argparse
+import base64
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detectors import SecretScanner
+
+PLANTED = {
+    'jwt': lambda rnd: '.'.join([
+        base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').decode().rstrip('='),
+        base64.urlsafe_b64encode(json.dumps({'sub': rnd.randint(1, 10 ** 6)}).encode()).decode().rstrip('='),
+        ''.join(rnd.choices(string.ascii_letters + string.digits + '_-', k=43)),
+    ]),
+    'aws_access_key': lambda rnd: 'AKIA' + ''.join(rnd.choices(string.ascii_uppercase + string.digits, k=16)),
+    'email': lambda rnd: f"user{rnd.randint(1, 10 ** 6)}@example.com",
+    'card_number': lambda rnd: '4111 1111 1111 1111',
+}
+
+
+def json_body(rnd, target_bytes, secret_rate):
+    # Realistic-looking API listing: ids, words, opaque blobs and the occasional planted secret
+    items = []
+    size = 0
+    while size < target_bytes:
+        item = {
+            'id': rnd.randint(1, 10 ** 9),
+            'name': ''.join(rnd.choices(string.ascii_letters, k=12)),
+            'description': ' '.join(''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(2, 9))) for _ in range(20)),
+            'etag': ''.join(rnd.choices(string.ascii_letters + string.digits, k=64)),
+            'price': round(rnd.random() * 1000, 2),
+            'created_at': '2024-01-01T00:00:00Z',
+            'tags': rnd.sample(['admin', 'user', 'beta', 'internal', 'public'], 2),
+        }
+        if rnd.random() < secret_rate:
+            kind = rnd.choice(list(PLANTED))
+            item[kind] = PLANTED[kind](rnd)
+        items.append(item)
+        size += len(json.dumps(item))
+    return json.dumps({'items': items}).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Secret detector throughput on a corpus of large JSON bodies")
+    parser.add_argument('--flows', type=int, default=200)
+    parser.add_argument('--body-kb', type=int, default=256)
+    parser.add_argument('--secret-rate', type=float, default=0.01, help="chance each JSON item carries a secret")
+    parser.add_argument('--budget-ms', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    corpus = [
+        {
+            'request_headers': json.dumps({'Authorization': f"Bearer {PLANTED['jwt'](rnd)}", 'Accept': 'application/json'}),
+            'request_body': b'',
+            'response_headers': json.dumps({'Content-Type': 'application/json'}),
+            'response_body': json_body(rnd, args.body_kb * 1024, args.secret_rate),
+        }
+        for _ in range(args.flows)
+    ]
+    total_bytes = sum(len(flow['response_body']) + len(flow['request_headers']) for flow in corpus)
+
+    results = {}
+    for label, budget_ms in (('unbounded', 10 ** 6), ('budgeted', args.budget_ms)):
+        scanner = SecretScanner(budget_ms=budget_ms)
+        samples = []
+        findings = 0
+        start = time.perf_counter()
+        for flow in corpus:
+            flow_start = time.perf_counter()
+            findings += len(scanner.scan(flow))
+            samples.append((time.perf_counter() - flow_start) * 1000)
+        elapsed = time.perf_counter() - start
+        samples.sort()
+        results[label] = {
+            'budget_ms': budget_ms if budget_ms < 10 ** 6 else None,
+            'flows': len(corpus),
+            'mb_per_sec': round(total_bytes / elapsed / 1024 / 1024, 2),
+            'flows_per_sec': round(len(corpus) / elapsed, 1),
+            'p50_ms': round(samples[len(samples) // 2], 3),
+            'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+            'findings': findings,
+            'over_budget': scanner.over_budget,
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import tempfile
+import threading
+
+import httpx
+
+from common import environment, summarize, timed, write_results
+
+from fake_ollama import FakeOllamaServer
+from llm import APISecurityAnalyzer
+from llm_backends import LLMRunner, OllamaBackend
+
+
+def request_response(i):
+    request = {'method': 'GET', 'url': f"https://api.example.com/users/{i}", 'headers': '{"Accept": "application/json"}',
+               'body': ''}
+    response = {'status': 200, 'headers': '{"Content-Type": "application/json"}', 'body': f'{{"id": {i}}}'}
+    return request, response
+
+
+def run(iterations=50, concurrency=8, token_delay=0.0):
+    server = FakeOllamaServer(token_delay=token_delay).start()
+    backend = OllamaBackend('bench', base_url=server.url)
+    analyzer = APISecurityAnalyzer('bench', cache_path=None)
+    analyzer.runner = LLMRunner(backend, concurrency=concurrency)
+    cached_analyzer = APISecurityAnalyzer('bench', cache_path=os.path.join(tempfile.mkdtemp(), 'cache.db'))
+    cached_analyzer.runner = analyzer.runner
+    client = httpx.Client(base_url=server.url)
+    counter = iter(range(10 ** 9))
+
+    def raw_roundtrip():
+        # The floor: one HTTP call to the stub with no prompt building, caching or runner hop
+        client.post('/api/generate', json={'model': 'bench', 'prompt': f"p{next(counter)}", 'stream': False}).json()
+
+    def analyze():
+        analyzer.analyze_vulnerability(*request_response(next(counter)))
+
+    def first_token():
+        stream = analyzer.stream_vulnerability_analysis(*request_response(next(counter)))
+        next(stream)
+        for _ in stream:
+            pass
+
+    cached_call = request_response(0)
+    cached_analyzer.analyze_vulnerability(*cached_call)
+
+    results = {
+        'raw_roundtrip': timed(raw_roundtrip, iterations),
+        'analyze_uncached': timed(analyze, iterations),
+        'analyze_stream': timed(first_token, iterations),
+        'analyze_cache_hit': timed(lambda: cached_analyzer.analyze_vulnerability(*cached_call), iterations),
+    }
+    results['analyze_overhead_p50_ms'] = round(results['analyze_uncached']['p50_ms'] - results['raw_roundtrip']['p50_ms'], 3)
+
+    # Identical prompts from many threads at once should reach the model once
+    before = server.requests
+    samples = []
+    barrier = threading.Barrier(concurrency)
+    prompt = request_response(10 ** 9)
+
+    def burst():
+        barrier.wait()
+        thread_samples = timed(lambda: analyzer.analyze_vulnerability(*prompt), 1, warmup=0)
+        samples.append(thread_samples['mean_ms'])
+
+    threads = [threading.Thread(target=burst) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results['coalesced_burst'] = dict(summarize(samples), callers=concurrency, backend_requests=server.requests - before)
+    results['runner'] = analyzer.runner.stats()
+
+    client.close()
+    analyzer.runner.close()
+    server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM path overhead against the stub Ollama server")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--token-delay', type=float, default=0.0, help="seconds the stub waits per token")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+    write_results({'environment': environment(), 'llm': run(args.iterations, args.concurrency, args.token_delay)},
+                  args.output)
+
+
+if __name__ == "__main__":
+    main()
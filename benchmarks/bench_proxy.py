@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import environment, summarize, write_results
+
+from store import APIStore
+
+
+def make_flows(count, seed=1):
+    # Mix of JSON API traffic, static assets the default filters skip, and a few large downloads
+    from mitmproxy import http
+    from mitmproxy.test import tflow
+
+    rnd = random.Random(seed)
+    flows = []
+    for i in range(count):
+        kind = rnd.random()
+        host = f"api{rnd.randint(0, 4)}.example.com"
+        if kind < 0.7:
+            method = rnd.choice(['GET', 'GET', 'POST', 'PUT'])
+            url = f"https://{host}/v1/users/{rnd.randint(1, 10 ** 6)}/orders?page={rnd.randint(1, 5)}"
+            request_body = json.dumps({'quantity': rnd.randint(1, 9), 'note': 'x' * rnd.randint(0, 200)}).encode() \
+                if method != 'GET' else b''
+            response_body = json.dumps({'items': [{'id': rnd.randint(1, 10 ** 9), 'sku': f"SKU-{j}"} for j in range(20)]}).encode()
+            content_type = 'application/json'
+        elif kind < 0.9:
+            method = 'GET'
+            url = f"https://{host}/static/{rnd.randint(1, 500)}.png"
+            request_body, response_body, content_type = b'', os.urandom(2048), 'image/png'
+        else:
+            method = 'GET'
+            url = f"https://{host}/v1/export/{i}"
+            request_body, response_body, content_type = b'', b'{"rows": "' + b'a' * (512 * 1024) + b'"}', 'application/json'
+        request = http.Request.make(method, url, request_body, {'Accept': 'application/json', 'User-Agent': 'bench'})
+        response = http.Response.make(200, response_body, {'Content-Type': content_type})
+        flows.append(tflow.tflow(req=request, resp=response))
+    return flows
+
+
+def run(flows=5000, seed=1):
+    try:
+        flow_list = make_flows(flows, seed)
+    except ImportError:
+        return {'skipped': "mitmproxy is not installed"}
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'bench.db')
+    store = APIStore(db_path)
+    store.add_whitelisted_domain('*.example.com')
+    store.conn.close()
+
+    # proxy.py builds an addon against ./api_security.db on import, keep that inside the scratch directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import proxy
+    finally:
+        os.chdir(cwd)
+    for addon in proxy.addons:
+        addon.done()
+
+    addon = proxy.APISecurityProxy(db_path)
+    samples = []
+    start = time.perf_counter()
+    for flow in flow_list:
+        flow_start = time.perf_counter()
+        addon.response(flow)
+        samples.append((time.perf_counter() - flow_start) * 1000)
+    hook_elapsed = time.perf_counter() - start
+    addon.done()
+    drained_elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(db_path)
+    captured = conn.execute("SELECT COUNT(*) FROM api_calls").fetchone()[0]
+    conn.close()
+    return {
+        'flows': len(flow_list),
+        'captured': captured,
+        'hook_flows_per_sec': round(len(flow_list) / hook_elapsed, 1),
+        'end_to_end_flows_per_sec': round(len(flow_list) / drained_elapsed, 1),
+        'added_latency': summarize(samples),
+        'writer': addon.writer.stats(),
+        'filter_skipped': dict(addon.filter.skipped),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic flows through the proxy addon")
+    parser.add_argument('--flows', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+    write_results({'environment': environment(), 'proxy': run(args.flows, args.seed)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import environment, timed, write_results
+
+from database import connect, connect_readonly
+from store import APIStore
+
+HOSTS = [f"api{i}.example.com" for i in range(20)]
+
+
+def populate(db_path, rows, seed=1, chunk=50000):
+    # Schema and migrations first on the empty file, then bulk rows straight into api_calls
+    APIStore(db_path).conn.close()
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    start = time.perf_counter()
+    for offset in range(0, rows, chunk):
+        batch = []
+        for i in range(offset, min(offset + chunk, rows)):
+            host = rnd.choice(HOSTS)
+            path = f"/v1/users/{rnd.randint(1, 10 ** 6)}/orders"
+            batch.append((
+                rnd.choice(['GET', 'GET', 'POST', 'PUT', 'DELETE']),
+                f"https://{host}{path}?page={i % 10}",
+                '{"Accept": "application/json"}',
+                '',
+                rnd.choice([200, 200, 200, 201, 401, 403, 404, 500]),
+                '{"Content-Type": "application/json"}',
+                '{"ok": true}',
+                1 if i % 1000 == 0 else 0,
+                'https', host, path, f"page={i % 10}",
+            ))
+        with conn:
+            conn.executemany('''
+            INSERT INTO api_calls (method, url, request_headers, request_body, response_status, response_headers,
+                                   response_body, is_important, scheme, host, path, query)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+    conn.execute("ANALYZE")
+    conn.close()
+    return round(time.perf_counter() - start, 2)
+
+
+def run(sizes=(10000, 100000, 1000000), iterations=20, seed=1):
+    results = {}
+    for rows in sizes:
+        db_path = os.path.join(tempfile.mkdtemp(), f"bench_{rows}.db")
+        populate_seconds = populate(db_path, rows, seed)
+        # Writer plus read-only connection, set up the way the UI does
+        conn = connect(db_path, check_same_thread=False)
+        read_conn = connect_readonly(db_path)
+        store = APIStore(db_path, conn=conn, read_conn=read_conn)
+        middle_id = rows // 2
+        size_results = {
+            'populate_seconds': populate_seconds,
+            'db_mb': round(os.path.getsize(db_path) / 1024 / 1024, 1),
+            'get_api_calls': timed(lambda: store.get_api_calls(limit=50), iterations),
+            'get_api_calls_deep_offset': timed(lambda: store.get_api_calls(limit=50, offset=middle_id), iterations),
+            'get_api_page': timed(lambda: store.get_api_page(limit=50), iterations),
+            'get_api_page_deep': timed(lambda: store.get_api_page(limit=50, before_id=middle_id), iterations),
+            'get_total_api_calls': timed(store.get_total_api_calls, iterations),
+            'get_important_apis': timed(store.get_important_apis, iterations),
+        }
+        store.add_whitelisted_domain('api3.example.com')
+        store.add_whitelisted_domain('*.no-traffic.test')
+        size_results['whitelisted'] = {
+            'get_api_page': timed(lambda: store.get_api_page(limit=50), iterations),
+            'get_total_api_calls': timed(store.get_total_api_calls, iterations),
+        }
+        read_conn.close()
+        conn.close()
+        os.remove(db_path)
+        results[str(rows)] = size_results
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the list queries on databases of increasing size")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="comma-separated row counts")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    write_results({'environment': environment(), 'queries': run(sizes, args.iterations, args.seed)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
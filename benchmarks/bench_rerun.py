@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from langchain.chains import LLMChain
+from langchain.llms import Ollama
+from langchain.prompts import PromptTemplate
+
+from common import environment, timed, write_results
+
+from llm import APISecurityAnalyzer, ANALYSIS_PROMPT, ANALYSIS_TEMPLATE
+from llm_backends import FakeBackend
+from store import APIStore
+
+
+class AnswerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment so keep-alive isn't skewed by delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({"answer": "ok"}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(iterations=50):
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    APIStore(db_path).conn.close()
+    request = {'method': 'GET', 'url': 'https://example.com/users/1', 'headers': '{}', 'body': ''}
+    response = {'status': 200, 'headers': '{}', 'body': '{"id": 1}'}
+
+    shared_conn = sqlite3.connect(db_path, check_same_thread=False)
+    shared_analyzer = APISecurityAnalyzer(cache_path=None, backend=FakeBackend())
+
+    def rerun_before():
+        # What every Streamlit rerun used to pay: new connection, schema checks, Ollama client and chain
+        store = APIStore(db_path)
+        llm = Ollama(model="gemma2:latest")
+        prompt = PromptTemplate(
+            input_variables=["method", "url", "req_headers", "req_body", "res_status", "res_headers", "res_body"],
+            template=ANALYSIS_TEMPLATE
+        )
+        chain = LLMChain(llm=llm, prompt=prompt)
+        chain.prompt.format(**shared_analyzer.analysis_inputs(request, response)[0])
+        store.conn.close()
+
+    def rerun_after():
+        APIStore(db_path, shared_analyzer, shared_conn)
+        ANALYSIS_PROMPT.format(**shared_analyzer.analysis_inputs(request, response)[0])
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), AnswerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/ask"
+    session = requests.Session()
+
+    results = {
+        'rerun_before': timed(rerun_before, iterations),
+        'rerun_after': timed(rerun_after, iterations),
+        'code_analysis_post_without_session': timed(lambda: requests.post(url, json={'question': 'q'}, timeout=5), iterations),
+        'code_analysis_post_with_session': timed(lambda: session.post(url, json={'question': 'q'}, timeout=5), iterations),
+    }
+    session.close()
+    shared_conn.close()
+    server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-rerun overhead before and after resource reuse")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+    write_results({'environment': environment(), 'rerun': run(args.iterations)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
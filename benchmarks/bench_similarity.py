@@ -0,0 +1,60 @@
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from common import environment, timed, write_results
+
+from similarity import HashingEmbedder, VectorIndex, endpoint_text, normalize_rows
+
+RESOURCES = ['users', 'orders', 'products', 'invoices', 'payments', 'sessions', 'tokens', 'settings', 'files', 'reports']
+
+
+def synthetic_endpoints(count, seed=1):
+    rnd = random.Random(seed)
+    for i in range(count):
+        segments = [f"v{rnd.randint(1, 3)}"] + [rnd.choice(RESOURCES) + ('/{id}' if rnd.random() < 0.5 else '')
+                                               for _ in range(rnd.randint(1, 3))]
+        yield endpoint_text(rnd.choice(['GET', 'POST', 'PUT', 'DELETE']), f"api{i % 50}.example.com",
+                            '/' + '/'.join(segments), ','.join(rnd.sample(RESOURCES, rnd.randint(0, 3))))
+
+
+def run(endpoints=100000, iterations=50, k=10, seed=1):
+    embedder = HashingEmbedder()
+    texts = list(synthetic_endpoints(2000, seed))
+    start = time.perf_counter()
+    embedder.embed(texts)
+    embed_per_sec = len(texts) / (time.perf_counter() - start)
+
+    # Search cost only depends on the row count, so the bulk of the index is random unit vectors
+    index = VectorIndex(tempfile.mkdtemp(), embedder.dim, embedder.signature)
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    for offset in range(0, endpoints, 10000):
+        size = min(10000, endpoints - offset)
+        index.add(np.arange(offset + 1, offset + size + 1),
+                  normalize_rows(rng.standard_normal((size, embedder.dim), dtype=np.float32)))
+    add_seconds = time.perf_counter() - start
+    queries = iter(normalize_rows(rng.standard_normal((iterations + 1, embedder.dim), dtype=np.float32)))
+    return {
+        'endpoints': endpoints,
+        'dim': embedder.dim,
+        'embed_per_sec': round(embed_per_sec, 1),
+        'add_seconds': round(add_seconds, 2),
+        'search': timed(lambda: index.search(next(queries), k), iterations),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Brute-force cosine search over the endpoint vector index")
+    parser.add_argument('--endpoints', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+    write_results({'environment': environment(), 'similarity': run(args.endpoints, args.iterations)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import json
+
+from common import environment, write_results
+
+import bench_llm
+import bench_proxy
+import bench_queries
+import bench_rerun
+import bench_similarity
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current, threshold=0.2):
+    # Latency metrics (*_ms) that got slower and throughput metrics (*_per_sec) that dropped by more than threshold
+    regressions = {}
+    base, now = flatten(baseline), flatten(current)
+    for name, value in now.items():
+        old = base.get(name)
+        if not old or name.startswith('environment.'):
+            continue
+        change = (value - old) / old
+        if (name.endswith('_ms') and change > threshold) or (name.endswith('_per_sec') and change < -threshold):
+            regressions[name] = {'baseline': old, 'current': value, 'change': f"{change:+.0%}"}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the capture-to-UI benchmark suite")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes for a fast smoke run")
+    parser.add_argument('--skip', default='', help="comma-separated parts to skip: proxy, queries, llm, similarity, rerun")
+    parser.add_argument('--compare', help="baseline JSON from an earlier run to report regressions against")
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    skip = {part.strip() for part in args.skip.split(',') if part.strip()}
+    results = {'environment': environment()}
+    if 'proxy' not in skip:
+        results['proxy'] = bench_proxy.run(flows=1000 if args.quick else 10000)
+    if 'queries' not in skip:
+        results['queries'] = bench_queries.run(sizes=(10000,) if args.quick else (10000, 100000, 1000000),
+                                               iterations=5 if args.quick else 20)
+    if 'llm' not in skip:
+        results['llm'] = bench_llm.run(iterations=10 if args.quick else 50)
+    if 'similarity' not in skip:
+        results['similarity'] = bench_similarity.run(endpoints=10000 if args.quick else 100000,
+                                                     iterations=10 if args.quick else 50)
+    if 'rerun' not in skip:
+        results['rerun'] = bench_rerun.run(iterations=10 if args.quick else 50)
+    if args.compare:
+        with open(args.compare) as f:
+            results['regressions'] = compare(json.load(f), results, args.threshold)
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import hashlib
+import zlib
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_MAX_CAPTURE_BYTES = 2 * 1024 * 1024
+
+
+def body_hash(raw):
+    digest = hashlib.sha256(raw)
+    if isinstance(raw, CappedBody):
+        # Bodies sharing a prefix but not a length stay distinct
+        digest.update(f":{raw.size}".encode())
+    return digest.hexdigest()
+
+
+class CappedBody(bytes):
+    # The first max_capture_bytes of a longer body, cut before it is queued; size is the full length
+    size = 0
+
+
+def cap_body(raw, max_capture_bytes):
+    if not raw or len(raw) <= max_capture_bytes:
+        return raw
+    capped = CappedBody(memoryview(raw)[:max_capture_bytes])
+    capped.size = len(raw)
+    return capped
+
+
+def compress(raw):
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=3).compress(raw)
+    return 'zlib', zlib.compress(raw, 6)
+
+
+def decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Body was stored with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    return bytes(data)
+
+
+def body_text(raw, size, truncated):
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Truncation can split the last multi-byte character
+        if not truncated or e.start < len(raw) - 3:
+            return f"[binary body, {size} bytes]"
+        text = raw[:e.start].decode('utf-8')
+    if truncated:
+        text += f"\n...[truncated, {len(raw)} of {size} bytes captured]"
+    return text
+
+
+class BodyStore:
+    def __init__(self, max_capture_bytes=DEFAULT_MAX_CAPTURE_BYTES):
+        self.max_capture_bytes = max_capture_bytes
+
+    def store_many(self, conn, raw_bodies):
+        # Hashes every body, compresses only the ones the table doesn't already hold
+        hashes = []
+        pending = {}
+        for raw in raw_bodies:
+            if not raw:
+                hashes.append(None)
+                continue
+            digest = body_hash(raw)
+            hashes.append(digest)
+            pending.setdefault(digest, raw)
+        if not pending:
+            return hashes
+        cursor = conn.cursor()
+        digests = list(pending)
+        cursor.execute(f"SELECT hash FROM bodies WHERE hash IN ({', '.join('?' for _ in digests)})", digests)
+        for (existing,) in cursor.fetchall():
+            del pending[existing]
+        rows = []
+        for digest, raw in pending.items():
+            stored = raw[:self.max_capture_bytes]
+            size = raw.size if isinstance(raw, CappedBody) else len(raw)
+            codec, data = compress(stored)
+            rows.append((digest, codec, size, len(stored) < size, data))
+        cursor.executemany("INSERT OR IGNORE INTO bodies (hash, codec, size, truncated, data) VALUES (?, ?, ?, ?, ?)", rows)
+        return hashes
+
+    def load_raw(self, conn, digest):
+        # The stored bytes as captured, for exports; (b'', 0, False) when there is no body
+        if not digest:
+            return b'', 0, False
+        cursor = conn.cursor()
+        cursor.execute("SELECT codec, size, truncated, data FROM bodies WHERE hash = ?", (digest,))
+        result = cursor.fetchone()
+        if result is None:
+            logging.warning(f"Body {digest} is missing from the body store")
+            return b'', 0, False
+        codec, size, truncated, data = result
+        return decompress(codec, data), size, bool(truncated)
+
+    def load(self, conn, digest):
+        if not digest:
+            return ''
+        raw, size, truncated = self.load_raw(conn, digest)
+        if not size:
+            return ''
+        return body_text(raw, size, truncated)
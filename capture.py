@@ -0,0 +1,201 @@
+import sqlite3
+import queue
+import threading
+import time
+import logging
+from urllib.parse import urlsplit
+from bodystore import BodyStore, DEFAULT_MAX_CAPTURE_BYTES, cap_body
+from endpoints import EndpointIndex, endpoint_key
+from search import SearchIndex
+from detectors import FindingStore
+from schemas import SchemaStore
+from metrics import metrics
+from database import connect
+
+INSERT_API_CALL = '''
+INSERT INTO api_calls (method, url, request_headers, request_body_hash, response_status, response_headers,
+                       response_body_hash, scheme, host, path, query, endpoint_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def split_url(url):
+    parts = urlsplit(url)
+    return parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query
+
+
+def flow_body(message):
+    try:
+        return message.content or b''
+    except ValueError:
+        # Unknown or broken content-encoding, keep what was on the wire
+        return message.raw_content or b''
+
+
+def insert_rows(conn, batch, body_store, endpoint_index, findings=(), finding_store=None, search_index=None,
+                schema_store=None):
+    # Runs inside the caller's transaction; rows carry raw request/response bytes at 3 and 6,
+    # swapped here for body store hashes. Returns the id of the first inserted row.
+    hashes = body_store.store_many(conn, [row[3] for row in batch] + [row[6] for row in batch])
+    endpoint_ids = endpoint_index.assign_many(
+        conn, [endpoint_key(row[0], row[8], row[9], row[10], row[3]) for row in batch]
+    )
+    if schema_store is not None:
+        schema_store.update_many(conn, [(endpoint_ids[i], 'request', row[3]) for i, row in enumerate(batch)] +
+                                 [(endpoint_ids[i], 'response', row[6]) for i, row in enumerate(batch)])
+    rows = [
+        row[:3] + (hashes[i],) + row[4:6] + (hashes[len(batch) + i],) + row[7:11] + (endpoint_ids[i],)
+        for i, row in enumerate(batch)
+    ]
+    conn.executemany(INSERT_API_CALL, rows)
+    # The write transaction holds the lock, so the batch got consecutive ids ending at MAX(id)
+    first_id = conn.execute("SELECT MAX(id) FROM api_calls").fetchone()[0] - len(batch) + 1
+    if any(findings):
+        finding_store.save_many(conn, [
+            (first_id + i, row_findings) for i, row_findings in enumerate(findings) if row_findings
+        ])
+    if search_index is not None:
+        search_index.index_many(conn, [
+            (first_id + i, row[1], row[2], row[3], row[5], row[6]) for i, row in enumerate(batch)
+        ])
+    return first_id
+
+
+class CaptureWriter:
+    def __init__(self, db_path='api_security.db', max_queue=10000, batch_size=200,
+                 flush_interval=0.5, block_timeout=0.0, stats_interval=30.0,
+                 max_capture_bytes=DEFAULT_MAX_CAPTURE_BYTES, scanner=None):
+        self.db_path = db_path
+        # Secret/PII detection runs here on the writer thread, off the proxy's event loop
+        self.scanner = scanner
+        self.finding_store = FindingStore()
+        self.max_capture_bytes = max_capture_bytes
+        self.body_store = BodyStore(max_capture_bytes)
+        self.endpoint_index = EndpointIndex()
+        self.schema_store = SchemaStore()
+        self.search_index = SearchIndex()
+        self.search_enabled = False
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # 0 means drop-and-count when full, > 0 waits that many seconds for room
+        self.block_timeout = block_timeout
+        self.stats_interval = stats_interval
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        # Cut bodies before queueing, or a burst of large bodies holds max_queue full copies in the proxy's memory
+        row = row[:3] + (cap_body(row[3], self.max_capture_bytes),) + row[4:6] + \
+            (cap_body(row[6], self.max_capture_bytes),) + row[7:]
+        try:
+            if self.block_timeout > 0:
+                self.queue.put(row, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(row)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            metrics.inc('capture_dropped_total')
+            return False
+        with self._stats_lock:
+            self.submitted += 1
+        return True
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'submitted': self.submitted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'flushes': self.flushes,
+                'last_flush_ms': round(self.last_flush_ms, 2),
+                'max_flush_ms': round(self.max_flush_ms, 2),
+                'avg_flush_ms': round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+                'scanner': self.scanner.stats() if self.scanner else None,
+            }
+
+    def close(self, timeout=10.0):
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning(f"Capture writer did not drain within {timeout}s, {self.queue.qsize()} flows pending")
+        logging.info(f"Capture writer stopped: {self.stats()}")
+
+    def _run(self):
+        conn = connect(self.db_path)
+        self.search_enabled = self.search_index.exists(conn)
+        last_report = time.monotonic()
+        try:
+            while True:
+                batch = self._collect()
+                if batch:
+                    self._flush(conn, batch)
+                if self.stats_interval and time.monotonic() - last_report >= self.stats_interval:
+                    logging.info(f"Capture writer stats: {self.stats()}")
+                    last_report = time.monotonic()
+                if self._stop.is_set() and self.queue.empty():
+                    break
+        finally:
+            conn.close()
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if self._stop.is_set():
+                    # Draining on shutdown, don't wait for the time trigger
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            findings = [
+                self.scanner.scan({
+                    'request_headers': row[2], 'request_body': row[3], 'response_headers': row[5],
+                    'response_body': row[6]
+                })
+                for row in batch
+            ] if self.scanner else []
+            with conn:
+                insert_rows(conn, batch, self.body_store, self.endpoint_index, findings, self.finding_store,
+                            self.search_index if self.search_enabled else None, self.schema_store)
+        except Exception as e:
+            # One bad batch must not end the writer thread, or every later flow would queue up and be dropped
+            kind = "Database error" if isinstance(e, sqlite3.Error) else "Error"
+            logging.exception(f"{kind} while flushing {len(batch)} captured flows, dropping them: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            with self._stats_lock:
+                self.dropped += len(batch)
+            metrics.inc('capture_dropped_total', len(batch))
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self.written += len(batch)
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+        metrics.observe('capture_flush_ms', elapsed_ms)
+        metrics.inc('capture_rows_written_total', len(batch))
+        logging.debug(f"Flushed {len(batch)} captured flows in {elapsed_ms:.1f}ms, queue depth {self.queue.qsize()}")
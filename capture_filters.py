@@ -0,0 +1,183 @@
+import fnmatch
+import json
+import logging
+import re
+import time
+from collections import Counter
+from endpoints import template_path
+
+DEFAULT_FILTER_RULES = {
+    'content_type_allow': [],
+    'content_type_deny': ['image/*', 'font/*', 'video/*', 'audio/*', 'text/css', 'text/javascript',
+                          'application/javascript', 'application/x-javascript', 'application/font-*'],
+    'method_deny': ['OPTIONS'],
+    'path_allow': [],
+    'path_deny': ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp', '*.woff', '*.woff2', '*.ttf',
+                  '*.css', '*.js', '*.map', '/health', '/healthz', '/ping', '/metrics'],
+    'status_allow': [],
+    'status_deny': [],
+    'max_body_bytes': 10 * 1024 * 1024,
+    'sample_per_minute': 0,
+}
+
+
+def load_filter_rules(conn):
+    rules = dict(DEFAULT_FILTER_RULES)
+    cursor = conn.execute("SELECT name, value FROM capture_filter_rules")
+    for name, value in cursor.fetchall():
+        if name in rules:
+            rules[name] = json.loads(value)
+    return rules
+
+
+def save_filter_rules(conn, rules):
+    conn.executemany("INSERT OR REPLACE INTO capture_filter_rules (name, value) VALUES (?, ?)",
+                     [(name, json.dumps(rules[name])) for name in DEFAULT_FILTER_RULES if name in rules])
+    conn.commit()
+
+
+def glob_regex(patterns, ignore_case=False):
+    # All globs of a list folded into one regex, None when the list is empty
+    patterns = [pattern.strip() for pattern in patterns if pattern and pattern.strip()]
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE if ignore_case else 0)
+
+
+def status_matcher(patterns):
+    # "404", "5xx" and "200-299" style entries
+    exact = set()
+    ranges = []
+    for pattern in patterns:
+        pattern = str(pattern).strip().lower()
+        if re.fullmatch(r'[1-5]xx', pattern):
+            ranges.append((int(pattern[0]) * 100, int(pattern[0]) * 100 + 99))
+        elif re.fullmatch(r'\d{3}-\d{3}', pattern):
+            low, high = pattern.split('-')
+            ranges.append((int(low), int(high)))
+        elif pattern.isdigit():
+            exact.add(int(pattern))
+    if not exact and not ranges:
+        return None
+    return lambda status: status in exact or any(low <= status <= high for low, high in ranges)
+
+
+class CaptureFilter:
+    def __init__(self, conn, reload_interval=1.0, stats_interval=10.0):
+        self.conn = conn
+        self.reload_interval = reload_interval
+        self.stats_interval = stats_interval
+        self.rules = None
+        self.data_version = None
+        self.last_check = 0.0
+        self.last_report = time.monotonic()
+        self.kept = 0
+        self.skipped = Counter()
+        self.unsaved = Counter()
+        self.sample_window = 0
+        self.sample_counts = Counter()
+        self.reload(force=True)
+
+    def reload(self, force=False):
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if not force and data_version == self.data_version:
+            return False
+        self.data_version = data_version
+        try:
+            rules = load_filter_rules(self.conn)
+        except Exception as e:
+            logging.error(f"Error loading capture filter rules: {e}")
+            return False
+        if rules == self.rules:
+            return False
+        self.compile(rules)
+        logging.info(f"Loaded capture filter rules: {rules}")
+        return True
+
+    def compile(self, rules):
+        self.rules = rules
+        self.content_type_allow = glob_regex(rules['content_type_allow'], ignore_case=True)
+        self.content_type_deny = glob_regex(rules['content_type_deny'], ignore_case=True)
+        self.method_deny = {method.strip().upper() for method in rules['method_deny'] if method.strip()}
+        self.path_allow = glob_regex(rules['path_allow'])
+        self.path_deny = glob_regex(rules['path_deny'])
+        self.status_allow = status_matcher(rules['status_allow'])
+        self.status_deny = status_matcher(rules['status_deny'])
+        self.max_body_bytes = int(rules['max_body_bytes'] or 0)
+        self.sample_per_minute = int(rules['sample_per_minute'] or 0)
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self.last_check < self.reload_interval:
+            return
+        self.last_check = now
+        self.reload()
+
+    def skip_reason(self, method, host, path, status, content_type, body_bytes):
+        # Cheapest checks first; returns None when the flow should be captured
+        if method in self.method_deny:
+            return 'method'
+        if self.path_allow is not None and not self.path_allow.match(path):
+            return 'path'
+        if self.path_deny is not None and self.path_deny.match(path):
+            return 'path'
+        if self.status_allow is not None and not self.status_allow(status):
+            return 'status'
+        if self.status_deny is not None and self.status_deny(status):
+            return 'status'
+        content_type = content_type.split(';', 1)[0].strip()
+        if self.content_type_allow is not None and not self.content_type_allow.match(content_type):
+            return 'content_type'
+        if self.content_type_deny is not None and self.content_type_deny.match(content_type):
+            return 'content_type'
+        if self.max_body_bytes and body_bytes > self.max_body_bytes:
+            return 'body_size'
+        if self.sample_per_minute:
+            window = int(time.time() // 60)
+            if window != self.sample_window:
+                self.sample_window = window
+                self.sample_counts.clear()
+            key = (method, host, template_path(path))
+            self.sample_counts[key] += 1
+            if self.sample_counts[key] > self.sample_per_minute:
+                return 'sampled'
+        return None
+
+    def check(self, method, host, path, status, content_type, body_bytes):
+        self.maybe_reload()
+        reason = self.skip_reason(method, host, path, status, content_type or '', body_bytes)
+        if reason is None:
+            self.kept += 1
+        else:
+            self.skipped[reason] += 1
+        self.unsaved[reason or 'captured'] += 1
+        self.maybe_report()
+        return reason is None
+
+    def count(self, reason):
+        # Flows skipped before the filter ran, e.g. hosts outside the whitelist
+        self.skipped[reason] += 1
+        self.unsaved[reason] += 1
+        self.maybe_report()
+
+    def maybe_report(self):
+        now = time.monotonic()
+        if now - self.last_report < self.stats_interval:
+            return
+        self.last_report = now
+        self.report()
+
+    def report(self):
+        # Counters replace per-flow log lines; they are also persisted for the sidebar
+        if not self.unsaved:
+            return
+        logging.info(f"Capture filter: {self.kept} captured, skipped {dict(self.skipped)}")
+        try:
+            self.conn.executemany('''
+            INSERT INTO capture_stats (reason, count) VALUES (?, ?)
+            ON CONFLICT(reason) DO UPDATE SET count = count + excluded.count
+            ''', list(self.unsaved.items()))
+            self.conn.commit()
+            self.unsaved.clear()
+        except Exception as e:
+            logging.error(f"Error saving capture stats: {e}")
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+
+from database import connect
+from endpoints import template_path
+from metrics import metrics
+
+# (connect, read) seconds; the code-analysis service can take a while to answer
+DEFAULT_TIMEOUT = (5, 300)
+# Worth another try: the service is busy or restarting, not rejecting the question
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def config_hash(config):
+    # Answers depend on the service asked and the question's wording, so a new config starts a new cache
+    text = json.dumps([config['endpoint'], config['parameter'], config['value_template']])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def invalidate_code_analysis_cache(conn, config):
+    conn.execute("DELETE FROM code_analysis_cache WHERE config_hash != ?", (config_hash(config),))
+    conn.commit()
+
+
+def endpoint_path(url):
+    parsed_url = urlparse(url)
+    path = parsed_url.path
+    if parsed_url.query:
+        path += f"?{parsed_url.query}"
+    return path
+
+
+def route_key(method, url):
+    # Every request to the same templated route maps to the same handler in the code
+    return method, template_path(urlparse(url).path)
+
+
+class CodeAnalysisError(Exception):
+    pass
+
+
+class CodeLookup:
+    def __init__(self, session, db_path='api_security.db', timeout=DEFAULT_TIMEOUT, retries=2, backoff=1.0,
+                 concurrency=4):
+        self.session = session
+        self.conn = connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+
+    def get_cached(self, config, method, url):
+        with self.lock:
+            cursor = self.conn.execute('''
+            SELECT answer FROM code_analysis_cache WHERE method = ? AND path_template = ? AND config_hash = ?
+            ''', (*route_key(method, url), config_hash(config)))
+            result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_cached_many(self, config, calls):
+        # calls: (api_id, method, url); every distinct route is looked up in one query
+        keys = {api_id: route_key(method, url) for api_id, method, url in calls}
+        routes = list(set(keys.values()))
+        found = {}
+        with self.lock:
+            for start in range(0, len(routes), 400):
+                chunk = routes[start:start + 400]
+                cursor = self.conn.execute(f'''
+                SELECT method, path_template, answer FROM code_analysis_cache
+                WHERE (method, path_template) IN (VALUES {', '.join('(?, ?)' for _ in chunk)}) AND config_hash = ?
+                ''', [value for key in chunk for value in key] + [config_hash(config)])
+                found.update(((method, path_template), answer) for method, path_template, answer in cursor)
+        return {api_id: found[key] for api_id, key in keys.items() if key in found}
+
+    def save(self, config, method, url, answer, api_id=None):
+        with self.lock:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO code_analysis_cache (method, path_template, config_hash, answer, api_id)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (*route_key(method, url), config_hash(config), answer, api_id))
+            self.conn.commit()
+
+    def fetch(self, config, method, url, request_body):
+        path = f"{method} {endpoint_path(url)}"
+        value = config['value_template'].format(endpoint_path=path, request_body=request_body)
+        data = {config['parameter']: value}
+        logging.info(f"Analyzing endpoint: {path}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Request body: {request_body}")
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.timer('code_analysis_ms') as timer:
+                    response = self.session.post(config['endpoint'], json=data, timeout=self.timeout)
+                    if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                        raise requests.HTTPError(f"{response.status_code} from {config['endpoint']}", response=response)
+                    response.raise_for_status()
+                logging.info(f"Received response from code analysis endpoint in {timer.elapsed_ms:.0f}ms")
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                retryable = not isinstance(e, requests.HTTPError) or e.response.status_code in RETRY_STATUSES
+                if not retryable or attempt == self.retries:
+                    raise CodeAnalysisError(f"Error getting code analysis: {e}") from e
+                delay = self.backoff * 2 ** attempt
+                logging.warning(f"Code analysis for {path} failed ({e}), retrying in {delay:.0f}s")
+                metrics.inc('code_analysis_retries_total')
+                time.sleep(delay)
+        try:
+            answer = response.json().get("answer", "No answer provided in the response.")
+        except json.JSONDecodeError as e:
+            metrics.inc('code_analysis_errors_total')
+            raise CodeAnalysisError(f"Error parsing JSON response: {e}") from e
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Parsed answer from JSON response: {answer}")
+        return answer
+
+    def lookup(self, config, method, url, request_body, api_id=None, refresh=False):
+        if not refresh:
+            answer = self.get_cached(config, method, url)
+            metrics.inc('code_analysis_cache_total', result='hit' if answer is not None else 'miss')
+            if answer is not None:
+                return answer
+        answer = self.fetch(config, method, url, request_body)
+        self.save(config, method, url, answer, api_id)
+        return answer
+
+    def lookup_many(self, config, calls, load_body, progress=None):
+        # calls: (api_id, method, url). Asks once per uncached route, at most `concurrency` at a time.
+        # Returns ({api_id: answer}, {api_id: error}); load_body(api_id) is only called for routes being asked.
+        answers = self.get_cached_many(config, calls)
+        routes = {}
+        for api_id, method, url in calls:
+            if api_id not in answers:
+                routes.setdefault(route_key(method, url), []).append((api_id, method, url))
+        errors = {}
+        if not routes:
+            return answers, errors
+        logging.info(f"Fetching code analysis for {len(routes)} routes, {self.concurrency} at a time")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='code-lookup') as executor:
+            futures = {}
+            for members in routes.values():
+                api_id, method, url = members[-1]
+                future = executor.submit(self.lookup, config, method, url, load_body(api_id), api_id, True)
+                futures[future] = members
+            for done, future in enumerate(as_completed(futures), start=1):
+                members = futures[future]
+                try:
+                    answer = future.result()
+                    answers.update((api_id, answer) for api_id, _, _ in members)
+                except CodeAnalysisError as e:
+                    logging.error(str(e))
+                    errors.update((api_id, str(e)) for api_id, _, _ in members)
+                if progress:
+                    progress(done, len(futures))
+        return answers, errors
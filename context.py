@@ -0,0 +1,107 @@
+import json
+from schemas import prompt_body
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+
+def truncate_to_tokens(text, max_tokens):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f"...[{len(text) - max_chars} more characters elided]"
+
+
+def elide_json(value, max_items=3, max_string=200, depth=0, max_depth=8):
+    # Keeps every key and the shape of the document, drops the tail of long arrays and strings
+    if depth >= max_depth:
+        return "..."
+    if isinstance(value, dict):
+        return {key: elide_json(item, max_items, max_string, depth + 1, max_depth) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [elide_json(item, max_items, max_string, depth + 1, max_depth) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"... {len(value) - max_items} more items")
+        return items
+    if isinstance(value, str) and len(value) > max_string:
+        return value[:max_string] + f"...[{len(value) - max_string} more characters]"
+    return value
+
+
+def compact_body(body, max_tokens):
+    if not body or estimate_tokens(body) <= max_tokens:
+        return body or ''
+    try:
+        parsed = json.loads(body)
+    except (ValueError, RecursionError):
+        # Too deeply nested for the parser is treated like any other non-JSON body
+        return truncate_to_tokens(body, max_tokens)
+    # Tighten the elision until the document fits
+    for max_items, max_string in ((3, 200), (2, 80), (1, 40)):
+        compacted = json.dumps(elide_json(parsed, max_items, max_string), separators=(',', ':'))
+        if estimate_tokens(compacted) <= max_tokens:
+            return compacted
+    return truncate_to_tokens(compacted, max_tokens)
+
+
+class ChatContextBuilder:
+    def __init__(self, token_budget=3000, recent_turns=6, body_share=0.2, headers_share=0.1, summary_share=0.15):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.body_share = body_share
+        self.headers_share = headers_share
+        self.summary_share = summary_share
+
+    def split_turns(self, turns, summarized_until=0):
+        # Turns after the summary stay verbatim until twice the window, then the oldest window is folded
+        unsummarized = [turn for turn in turns if turn[0] > summarized_until]
+        if len(unsummarized) <= 2 * self.recent_turns:
+            return [], unsummarized
+        cut = len(unsummarized) - self.recent_turns
+        return unsummarized[:cut], unsummarized[cut:]
+
+    def build(self, api_call, message, summary='', turns=()):
+        body_tokens = int(self.token_budget * self.body_share)
+        headers_tokens = int(self.token_budget * self.headers_share)
+        request_section = f"""
+        API Request:
+        Method: {api_call['method']}
+        URL: {api_call['url']}
+        Headers: {truncate_to_tokens(api_call['request_headers'] or '', headers_tokens)}
+        Body: {compact_body(prompt_body(api_call['request_body'], api_call.get('request_schema')), body_tokens)}
+
+        API Response:
+        Status: {api_call['response_status']}
+        Headers: {truncate_to_tokens(api_call['response_headers'] or '', headers_tokens)}
+        Body: {compact_body(prompt_body(api_call['response_body'], api_call.get('response_schema')), body_tokens)}
+        """
+        summary_section = ''
+        if summary:
+            summary = truncate_to_tokens(summary, int(self.token_budget * self.summary_share))
+            summary_section = f"""
+        Summary of earlier conversation:
+        {summary}
+        """
+        remaining = self.token_budget - estimate_tokens(request_section + summary_section + message)
+        history = []
+        # Newest turns first so the oldest are the ones dropped when the budget runs out
+        for _, text, is_user in reversed(list(turns)):
+            line = [text, is_user]
+            cost = estimate_tokens(text) + 2
+            if cost > remaining:
+                if history:
+                    break
+                line[0] = truncate_to_tokens(text, max(remaining, 0))
+                cost = remaining
+            history.append(line)
+            remaining -= cost
+        history.reverse()
+        return f"""{request_section}{summary_section}
+        Chat History:
+        {json.dumps(history)}
+
+        User: {message}
+        """
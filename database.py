@@ -0,0 +1,39 @@
+import os
+import sqlite3
+from urllib.parse import quote
+
+DEFAULT_DB_PATH = 'api_security.db'
+# Seconds a connection waits on a locked database before raising "database is locked"
+BUSY_TIMEOUT = 30.0
+
+# Applied to every connection; journal_mode=WAL is stored in the file, the rest is per connection
+PRAGMAS = {
+    # WAL lets the proxy's writer and the UI's readers run at the same time; NORMAL only syncs at checkpoints
+    'synchronous': 'NORMAL',
+    'cache_size': -32768,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'journal_size_limit': 64 * 1024 * 1024,
+}
+
+
+def apply_pragmas(conn, pragmas=PRAGMAS):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def connect(db_path=DEFAULT_DB_PATH, check_same_thread=True, isolation_level=''):
+    # isolation_level '' is sqlite3's default (implicit BEGIN before writes), None is autocommit
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread,
+                           isolation_level=isolation_level)
+    conn.execute("PRAGMA journal_mode = WAL")
+    apply_pragmas(conn)
+    return conn
+
+
+def connect_readonly(db_path=DEFAULT_DB_PATH, check_same_thread=False):
+    # For browsing: can't take the write lock, so it never queues behind or blocks the capture writer
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(db_path))}?mode=ro", uri=True, timeout=BUSY_TIMEOUT,
+                           check_same_thread=check_same_thread)
+    apply_pragmas(conn, dict(PRAGMAS, query_only='ON'))
+    return conn
@@ -0,0 +1,294 @@
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import math
+import re
+import time
+from collections import Counter
+
+from database import connect
+
+# Bodies are scanned up to this many bytes each, and every flow gets this much time across its four fields
+DEFAULT_MAX_SCAN_BYTES = 512 * 1024
+DEFAULT_BUDGET_MS = 20.0
+SCAN_CHUNK_CHARS = 64 * 1024
+SCAN_OVERLAP_CHARS = 512
+SCAN_FIELDS = ('request_headers', 'request_body', 'response_headers', 'response_body')
+
+# Every pattern opens with a literal or a narrow character class so the regex engine can skip ahead;
+# boundary lookbehinds sit after that first character for the same reason
+SECRET_PATTERNS = {
+    'jwt': r'eyJ(?<![A-Za-z0-9_-]eyJ)[A-Za-z0-9_-]{8,}\.eyJ[A-Za-z0-9_-]{8,}\.[A-Za-z0-9_-]{8,}',
+    'aws_access_key': r'A(?:KIA|SIA|GPA|IDA|ROA|NPA)(?<![A-Z0-9]....)[A-Z0-9]{16}(?![A-Z0-9])',
+    'aws_secret_key': r'[Aa](?i:ws)[A-Za-z0-9_ .-]{0,20}?(?i:secret)[A-Za-z0-9_ .-]{0,20}?["\']?\s*[:=]\s*["\']?'
+                      r'[A-Za-z0-9/+]{40}(?![A-Za-z0-9/+])',
+    'bearer_token': r'[Bb](?i:earer)\s+[A-Za-z0-9._~+/-]{16,}=*',
+    'private_key': r'-----BEGIN (?:RSA |EC |DSA |OPENSSH |ENCRYPTED )?PRIVATE KEY-----',
+    'generic_secret': r'[AaSsPpRrCc](?<![A-Za-z0-9_][AaSsPpRrCc])(?i:(?<=a)pi[_-]?key|(?<=s)ecret|(?<=a)ccess[_-]?token'
+                      r'|(?<=r)efresh[_-]?token|(?<=c)lient[_-]?secret|(?<=p)assw(?:or)?d)["\']?\s*[:=]\s*["\']'
+                      r'([^"\'\s,}]{12,200})',
+    # Matched from the @, the local part is recovered by email_value
+    'email': r'@[A-Za-z0-9-]{1,63}(?:\.[A-Za-z0-9-]{1,63})*\.[A-Za-z]{2,24}(?![A-Za-z])',
+    'card_number': r'[3-6](?<![0-9][3-6])[0-9]{3}(?:[ -]?[0-9]{4}){2}[ -]?[0-9]{1,7}(?![0-9])',
+}
+# Substrings a body must contain for a pattern to be worth running, checked with plain `in`
+PATTERN_TRIGGERS = {
+    'jwt': ('eyJ',),
+    'aws_access_key': ('AKIA', 'ASIA', 'AGPA', 'AIDA', 'AROA', 'ANPA'),
+    'aws_secret_key': ('aws',),
+    'bearer_token': ('bearer',),
+    'private_key': ('PRIVATE KEY-----',),
+    'generic_secret': ('key', 'secret', 'token', 'passw'),
+    'email': ('@',),
+    'card_number': (),
+}
+# Triggers matched against the lowercased text
+CASELESS_TRIGGERS = {'aws_secret_key', 'bearer_token', 'generic_secret'}
+EMAIL_LOCAL_PART = re.compile(r'[A-Za-z0-9._%+-]{1,64}$')
+SEVERITY = {
+    'private_key': 'high', 'aws_access_key': 'high', 'aws_secret_key': 'high', 'jwt': 'high',
+    'bearer_token': 'high', 'generic_secret': 'medium', 'card_number': 'high', 'email': 'low',
+}
+# Minimum bits per character for matches that are only secrets when they look random
+MIN_ENTROPY = {'bearer_token': 3.0, 'generic_secret': 3.0, 'aws_secret_key': 3.5}
+PLACEHOLDER_VALUES = re.compile(r'^(?:x+|\*+|\.+|null|none|undefined|true|false|redacted|changeme|password|example)$', re.I)
+
+
+def shannon_entropy(value):
+    if not value:
+        return 0.0
+    counts = Counter(value)
+    return -sum(count / len(value) * math.log2(count / len(value)) for count in counts.values())
+
+
+def luhn_valid(digits):
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        n = int(digit)
+        if i % 2:
+            n = n * 2 - 9 if n > 4 else n * 2
+        total += n
+    return total % 10 == 0
+
+
+def jwt_valid(token):
+    header = token.split('.', 1)[0]
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(header + '=' * (-len(header) % 4)))
+    except (ValueError, TypeError):
+        return False
+    return isinstance(decoded, dict) and 'alg' in decoded
+
+
+# Compiled one by one: a single alternation would lose each pattern's first-character skip and run ~3x slower
+SECRET_REGEXES = {kind: re.compile(f"(?P<{kind}>{pattern})") for kind, pattern in SECRET_PATTERNS.items()}
+
+
+def candidate_kinds(text):
+    # Cheap substring prefilter, most bodies rule out most patterns before any regex runs
+    lowered = None
+    kinds = []
+    for kind, triggers in PATTERN_TRIGGERS.items():
+        if not triggers:
+            kinds.append(kind)
+            continue
+        if kind in CASELESS_TRIGGERS:
+            if lowered is None:
+                lowered = text.lower()
+            haystack = lowered
+        else:
+            haystack = text
+        if any(trigger in haystack for trigger in triggers):
+            kinds.append(kind)
+    return tuple(kinds)
+
+
+def email_value(text, match):
+    local = EMAIL_LOCAL_PART.search(text, max(match.start() - 64, 0), match.start())
+    return local.group(0) + match.group('email') if local else None
+
+
+def secret_value(kind, match):
+    if kind == 'email':
+        return email_value(match.string, match)
+    if kind == 'generic_secret':
+        return match.group(match.re.groupindex[kind] + 1)
+    if kind == 'bearer_token':
+        return match.group(kind).split(None, 1)[1]
+    if kind == 'aws_secret_key':
+        return match.group(kind)[-40:]
+    return match.group(kind)
+
+
+def validate(kind, value):
+    if value is None:
+        return False
+    if kind == 'card_number':
+        digits = re.sub(r'[ -]', '', value)
+        return 13 <= len(digits) <= 19 and luhn_valid(digits)
+    if kind == 'jwt':
+        return jwt_valid(value)
+    if kind in MIN_ENTROPY:
+        return not PLACEHOLDER_VALUES.match(value) and shannon_entropy(value) >= MIN_ENTROPY[kind]
+    return True
+
+
+def mask(value):
+    if len(value) <= 8:
+        return '*' * len(value)
+    return f"{value[:4]}…{value[-4:]} ({len(value)} chars)"
+
+
+class Finding:
+    __slots__ = ('kind', 'location', 'offset', 'preview', 'value_hash')
+
+    def __init__(self, kind, location, offset, preview, value_hash):
+        self.kind = kind
+        self.location = location
+        self.offset = offset
+        self.preview = preview
+        self.value_hash = value_hash
+
+    def __repr__(self):
+        return f"Finding(kind={self.kind!r}, location={self.location!r}, preview={self.preview!r})"
+
+
+class SecretScanner:
+    def __init__(self, max_scan_bytes=DEFAULT_MAX_SCAN_BYTES, budget_ms=DEFAULT_BUDGET_MS):
+        self.max_scan_bytes = max_scan_bytes
+        self.budget_ms = budget_ms
+        self.scanned = 0
+        self.over_budget = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def text(self, value):
+        if not value:
+            return ''
+        if isinstance(value, str):
+            return value[:self.max_scan_bytes]
+        # Binary bodies are scanned too, secrets in them are still ASCII
+        return value[:self.max_scan_bytes].decode('utf-8', 'replace')
+
+    def scan(self, fields):
+        # fields maps location -> str/bytes; stops at the time budget and counts the flow as over budget
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000
+        findings = []
+        seen = set()
+        exhausted = False
+        for location in SCAN_FIELDS:
+            text = self.text(fields.get(location))
+            regexes = [SECRET_REGEXES[kind] for kind in candidate_kinds(text)]
+            position = 0
+            while position < len(text) and not exhausted:
+                end = min(position + SCAN_CHUNK_CHARS, len(text))
+                # Overlap chunks a little so a secret straddling the boundary is still matched whole
+                matches = (
+                    match for regex in regexes
+                    for match in regex.finditer(text, position, min(end + SCAN_OVERLAP_CHARS, len(text)))
+                    if match.start() < end
+                )
+                for match in matches:
+                    kind = match.lastgroup
+                    value = secret_value(kind, match)
+                    if not validate(kind, value):
+                        continue
+                    value_hash = hashlib.sha256(value.encode('utf-8', 'replace')).hexdigest()[:32]
+                    if (kind, location, value_hash) in seen:
+                        continue
+                    seen.add((kind, location, value_hash))
+                    findings.append(Finding(kind, location, match.start(), mask(value), value_hash))
+                position = end
+                if time.perf_counter() > deadline:
+                    exhausted = True
+            if exhausted:
+                break
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.scanned += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if exhausted:
+            self.over_budget += 1
+        return findings
+
+    def stats(self):
+        return {
+            'scanned': self.scanned,
+            'over_budget': self.over_budget,
+            'avg_ms': round(self.total_ms / self.scanned, 3) if self.scanned else 0.0,
+            'max_ms': round(self.max_ms, 3),
+        }
+
+
+class FindingStore:
+    def save_many(self, conn, findings_by_api):
+        conn.executemany('''
+        INSERT INTO findings (api_id, kind, severity, location, offset, preview, value_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (api_id, finding.kind, SEVERITY[finding.kind], finding.location, finding.offset, finding.preview,
+             finding.value_hash)
+            for api_id, findings in findings_by_api for finding in findings
+        ])
+
+    def delete(self, conn, api_id=None):
+        if api_id is None:
+            conn.execute("DELETE FROM findings")
+        else:
+            conn.execute("DELETE FROM findings WHERE api_id = ?", (api_id,))
+
+
+def scan_existing(conn, scanner, batch_size=500):
+    # Background pass over calls captured before detection was enabled, or after the rules changed
+    from bodystore import BodyStore
+    body_store = BodyStore()
+    finding_store = FindingStore()
+    cursor = conn.cursor()
+    last_id = 0
+    total = 0
+    while True:
+        cursor.execute('''
+        SELECT id, request_headers, request_body, request_body_hash, response_headers, response_body,
+               response_body_hash
+        FROM api_calls WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        findings_by_api = []
+        for api_id, request_headers, request_body, request_hash, response_headers, response_body, response_hash in rows:
+            findings_by_api.append((api_id, scanner.scan({
+                'request_headers': request_headers,
+                'request_body': body_store.load(conn, request_hash) if request_hash else request_body,
+                'response_headers': response_headers,
+                'response_body': body_store.load(conn, response_hash) if response_hash else response_body,
+            })))
+        with conn:
+            conn.execute(f"DELETE FROM findings WHERE api_id IN ({', '.join('?' for _ in rows)})",
+                         [row[0] for row in rows])
+            finding_store.save_many(conn, findings_by_api)
+        total += sum(len(findings) for _, findings in findings_by_api)
+        last_id = rows[-1][0]
+    return total
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Scan captured API calls for secrets and personal data")
+    parser.add_argument('--db', default='api_security.db')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    args = parser.parse_args()
+    from store import migrate_database
+    scanner = SecretScanner(budget_ms=args.budget_ms)
+    conn = connect(args.db)
+    migrate_database(conn)
+    total = scan_existing(conn, scanner)
+    conn.close()
+    logging.info(f"Recorded {total} findings, scanner stats: {scanner.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import re
+import json
+import logging
+from urllib.parse import parse_qsl
+from bodystore import BodyStore
+
+ID_PLACEHOLDER = '{id}'
+UUID_SEGMENT = re.compile(r'^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$')
+HEX_SEGMENT = re.compile(r'^(?=.*\d)[0-9a-fA-F]{8,}$')
+TOKEN_SEGMENT = re.compile(r'^(?=.*\d)(?=.*[A-Za-z])[A-Za-z0-9_\-=.~]{20,}$')
+MAX_SHAPE_BODY_BYTES = 64 * 1024
+
+
+def template_segment(segment):
+    if not segment:
+        return segment
+    if segment.isdigit() or UUID_SEGMENT.match(segment) or HEX_SEGMENT.match(segment) or TOKEN_SEGMENT.match(segment):
+        return ID_PLACEHOLDER
+    return segment
+
+
+def template_path(path):
+    return '/'.join(template_segment(segment) for segment in (path or '/').split('/'))
+
+
+def body_param_names(body):
+    if not body or len(body) > MAX_SHAPE_BODY_BYTES:
+        return []
+    if isinstance(body, str):
+        body = body.encode('utf-8', 'ignore')
+    stripped = body.lstrip()
+    if stripped[:1] == b'{':
+        try:
+            data = json.loads(stripped)
+        except (ValueError, RecursionError):
+            return []
+        return list(data) if isinstance(data, dict) else []
+    if b'=' in body and b' ' not in body:
+        return [name for name, _ in parse_qsl(body.decode('utf-8', 'ignore'), keep_blank_values=True)]
+    return []
+
+
+def param_shape(query, body=b''):
+    names = {name for name, _ in parse_qsl(query or '', keep_blank_values=True)}
+    names.update(body_param_names(body))
+    return ','.join(sorted(names))
+
+
+def endpoint_key(method, host, path, query, body=b''):
+    return (method or '', host or '', template_path(path), param_shape(query, body))
+
+
+class EndpointIndex:
+    def assign_many(self, conn, keys):
+        # Upserts hit counts for every key and returns the endpoint id for each one, in order
+        counts = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        cursor = conn.cursor()
+        cursor.executemany('''
+        INSERT INTO endpoints (method, host, path_template, param_shape, hit_count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (method, host, path_template, param_shape)
+        DO UPDATE SET hit_count = hit_count + excluded.hit_count, last_seen = CURRENT_TIMESTAMP
+        ''', [key + (count,) for key, count in counts.items()])
+        ids = {}
+        for key in counts:
+            cursor.execute('''
+            SELECT id FROM endpoints WHERE method = ? AND host = ? AND path_template = ? AND param_shape = ?
+            ''', key)
+            ids[key] = cursor.fetchone()[0]
+        return [ids[key] for key in keys]
+
+    def backfill(self, conn, batch_size=5000):
+        body_store = BodyStore()
+        cursor = conn.cursor()
+        backfilled = 0
+        last_id = 0
+        while True:
+            cursor.execute('''
+            SELECT id, method, host, path, query, request_body, request_body_hash FROM api_calls
+            WHERE endpoint_id IS NULL AND id > ? ORDER BY id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            keys = []
+            for _, method, host, path, query, inline_body, body_hash in rows:
+                body = body_store.load(conn, body_hash) if body_hash else inline_body
+                keys.append(endpoint_key(method, host, path, query, body or b''))
+            endpoint_ids = self.assign_many(conn, keys)
+            cursor.executemany("UPDATE api_calls SET endpoint_id = ? WHERE id = ?",
+                               [(endpoint_id, row[0]) for endpoint_id, row in zip(endpoint_ids, rows)])
+            conn.commit()
+            backfilled += len(rows)
+            last_id = rows[-1][0]
+        if backfilled:
+            logging.info(f"Assigned endpoints to {backfilled} captured API calls")
@@ -0,0 +1,100 @@
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from llm_backends import FakeBackend
+from similarity import HashingEmbedder
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.path not in ('/api/generate', '/api/embed'):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path == '/api/embed':
+            self.embed(request)
+            return
+        tokens = self.server.fake.response_tokens(request.get('prompt', ''))
+        self.server.requests += 1
+        if request.get('stream', True):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for token in tokens:
+                if self.server.token_delay:
+                    time.sleep(self.server.token_delay)
+                self.write_chunk({'model': request.get('model'), 'response': token, 'done': False})
+            self.write_chunk({'model': request.get('model'), 'response': '', 'done': True})
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay * len(tokens))
+            body = json.dumps({'model': request.get('model'), 'response': ''.join(tokens), 'done': True}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def embed(self, request):
+        texts = request.get('input', [])
+        texts = [texts] if isinstance(texts, str) else texts
+        body = json.dumps({'model': request.get('model'),
+                           'embeddings': self.server.embedder.embed(texts).tolist()}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        line = json.dumps(data).encode() + b'\n'
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    # Speaks the /api/generate and /api/embed subset the app uses, with deterministic answers per prompt
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, token_delay=0.0, tokens=24):
+        super().__init__((host, port), FakeOllamaHandler)
+        self.fake = FakeBackend(tokens=tokens)
+        # Wider than the index so the client's projection path is exercised
+        self.embedder = HashingEmbedder(dim=384)
+        self.token_delay = token_delay
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Deterministic stand-in for the Ollama generate and embed APIs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeOllamaServer(args.host, args.port, args.token_delay)
+    logging.info(f"Fake Ollama listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
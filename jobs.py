@@ -0,0 +1,308 @@
+import argparse
+import logging
+import threading
+import time
+from store import APIStore, migrate_database
+from database import connect
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+class AnalysisJobQueue:
+    def __init__(self, db_path='api_security.db'):
+        self.db_path = db_path
+        self.conn = connect(db_path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        migrate_database(self.conn)
+
+    def enqueue_query(self, select_api_ids, params=()):
+        # Skips APIs that already have a pending or running job
+        with self.lock:
+            cursor = self.conn.execute(f'''
+            INSERT INTO analysis_jobs (api_id)
+            SELECT candidate.id FROM ({select_api_ids}) candidate
+            WHERE NOT EXISTS (
+                SELECT 1 FROM analysis_jobs j WHERE j.api_id = candidate.id AND j.status IN ('queued', 'running')
+            )
+            ''', params)
+            return cursor.rowcount
+
+    def enqueue_unanalyzed(self):
+        # One job per endpoint (its latest request), plus requests not yet assigned to an endpoint
+        return self.enqueue_query('''
+        SELECT MAX(a.id) AS id FROM api_calls a
+        JOIN endpoints e ON e.id = a.endpoint_id
+        WHERE e.analysis_api_id IS NULL
+           OR NOT EXISTS (SELECT 1 FROM analysis_results r WHERE r.api_id = e.analysis_api_id)
+        GROUP BY a.endpoint_id
+        UNION ALL
+        SELECT a.id FROM api_calls a
+        WHERE a.endpoint_id IS NULL
+          AND NOT EXISTS (SELECT 1 FROM analysis_results r WHERE r.api_id = a.id)
+        ''')
+
+    def enqueue_important(self):
+        return self.enqueue_query('''
+        SELECT a.id FROM api_calls a
+        WHERE a.is_important = 1
+          AND NOT EXISTS (SELECT 1 FROM analysis_results r WHERE r.api_id = a.id)
+        ''')
+
+    def enqueue(self, api_ids):
+        return sum(self.enqueue_query("SELECT ? AS id", (api_id,)) for api_id in api_ids)
+
+    def claim(self):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute('''
+                SELECT id, api_id, attempts FROM analysis_jobs
+                WHERE status = 'queued' AND next_attempt_at <= ?
+                ORDER BY id LIMIT 1
+                ''', (now,))
+                job = cursor.fetchone()
+                if job is not None:
+                    self.conn.execute('''
+                    UPDATE analysis_jobs SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                    ''', (job[0],))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if job is None:
+            return None
+        return job[0], job[1], job[2] + 1
+
+    def claim_batch(self, max_jobs):
+        # The next due job plus queued siblings from the same host, ordered so templated routes sit together
+        if max_jobs <= 1:
+            job = self.claim()
+            return [job] if job else []
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute('''
+                SELECT j.id, j.api_id, j.attempts, a.host FROM analysis_jobs j LEFT JOIN api_calls a ON a.id = j.api_id
+                WHERE j.status = 'queued' AND j.next_attempt_at <= ?
+                ORDER BY j.id LIMIT 1
+                ''', (now,))
+                first = cursor.fetchone()
+                jobs = []
+                if first is not None:
+                    cursor = self.conn.execute('''
+                    SELECT j.id, j.api_id, j.attempts FROM analysis_jobs j
+                    JOIN api_calls a ON a.id = j.api_id
+                    LEFT JOIN endpoints e ON e.id = a.endpoint_id
+                    WHERE j.status = 'queued' AND j.next_attempt_at <= ? AND a.host = ? AND j.id != ?
+                    ORDER BY e.path_template, j.id LIMIT ?
+                    ''', (now, first[3], first[0], max_jobs - 1))
+                    jobs = [first[:3]] + cursor.fetchall()
+                    self.conn.execute(f'''
+                    UPDATE analysis_jobs SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE id IN ({', '.join('?' for _ in jobs)})
+                    ''', [job[0] for job in jobs])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return [(job_id, api_id, attempts + 1) for job_id, api_id, attempts in jobs]
+
+    def complete(self, job_id):
+        with self.lock:
+            self.conn.execute('''
+            UPDATE analysis_jobs SET status = 'done', error = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', (job_id,))
+
+    def drop(self, job_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM analysis_jobs WHERE id = ?", (job_id,))
+
+    def fail(self, job_id, attempts, error, max_attempts, backoff=5.0):
+        with self.lock:
+            if attempts < max_attempts:
+                self.conn.execute('''
+                UPDATE analysis_jobs SET status = 'queued', error = ?, next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                ''', (error, time.time() + backoff * 2 ** (attempts - 1), job_id))
+            else:
+                self.conn.execute('''
+                UPDATE analysis_jobs SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+                ''', (error, job_id))
+
+    def requeue_stale(self, stale_after=1800):
+        # Jobs left running by a process that died mid-analysis
+        with self.lock:
+            self.conn.execute('''
+            UPDATE analysis_jobs SET status = 'queued'
+            WHERE status = 'running' AND updated_at < datetime('now', ?)
+            ''', (f"-{int(stale_after)} seconds",))
+
+    def clear_finished(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM analysis_jobs WHERE status IN ('done', 'failed')")
+
+    def progress(self):
+        with self.lock:
+            cursor = self.conn.execute("SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status")
+            counts = dict(cursor.fetchall())
+        return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+
+class AnalysisWorkerPool:
+    def __init__(self, analyzer, db_path='api_security.db', concurrency=2, max_attempts=3, poll_interval=2.0,
+                 batch_size=1):
+        self.analyzer = analyzer
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.queue = AnalysisJobQueue(db_path)
+        self.threads = []
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def start(self, concurrency=None, batch_size=None):
+        if self.running and not self.stop_event.is_set():
+            return
+        if concurrency:
+            self.concurrency = concurrency
+        if batch_size:
+            self.batch_size = batch_size
+        # Threads still finishing their job after stop(timeout=0) keep the old, set, event and exit on their own
+        self.stop_event = threading.Event()
+        self.queue.requeue_stale()
+        self.threads = [
+            threading.Thread(target=self.work, args=(self.stop_event,), name=f"analysis-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in self.threads:
+            thread.start()
+        logging.info(f"Started {self.concurrency} analysis workers, up to {self.batch_size} APIs per prompt")
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def wait_until_drained(self):
+        while True:
+            progress = self.queue.progress()
+            if not progress['queued'] and not progress['running']:
+                return progress
+            time.sleep(self.poll_interval)
+
+    def work(self, stop_event):
+        store = APIStore(self.db_path, self.analyzer)
+        try:
+            while not stop_event.is_set():
+                try:
+                    jobs = self.queue.claim_batch(self.batch_size)
+                    if not jobs:
+                        stop_event.wait(self.poll_interval)
+                        continue
+                    if len(jobs) == 1:
+                        self.run_job(store, *jobs[0])
+                    else:
+                        self.run_batch(store, jobs)
+                except Exception as e:
+                    # e.g. the database stayed locked past the busy timeout; keep the worker alive and try again
+                    logging.exception(f"Analysis worker error: {e}")
+                    stop_event.wait(self.poll_interval)
+        finally:
+            store.conn.close()
+
+    def drop_deleted(self, job_id, api_id):
+        # The API was removed after it was queued; nothing left to analyze, so don't retry
+        logging.info(f"Dropping analysis job for deleted API ID: {api_id}")
+        self.queue.drop(job_id)
+
+    def run_job(self, store, job_id, api_id, attempts):
+        try:
+            api = store.get_api_call(api_id)
+            if api is None:
+                self.drop_deleted(job_id, api_id)
+                return
+            analysis = store.analyze_api(api)
+            store.save_analysis_result(api_id, analysis)
+            self.queue.complete(job_id)
+            logging.info(f"Analyzed API ID: {api_id}")
+        except Exception as e:
+            logging.error(f"Error analyzing API ID {api_id} (attempt {attempts}): {e}")
+            self.queue.fail(job_id, attempts, str(e), self.max_attempts)
+
+    def run_batch(self, store, jobs):
+        try:
+            apis = {api_id: store.get_api_call(api_id) for _, api_id, _ in jobs}
+            for job_id, api_id, _ in jobs:
+                if apis[api_id] is None:
+                    self.drop_deleted(job_id, api_id)
+            jobs = [job for job in jobs if apis[job[1]] is not None]
+            results = store.analyze_apis([apis[api_id] for _, api_id, _ in jobs]) if jobs else {}
+        except Exception as e:
+            # Retry each job on its own rather than failing the whole batch
+            logging.error(f"Error analyzing batch of {len(jobs)} APIs: {e}")
+            for job in jobs:
+                self.run_job(store, *job)
+            return
+        for job_id, api_id, attempts in jobs:
+            if api_id not in results:
+                # Not answered in the batch, analyze it on its own
+                self.run_job(store, job_id, api_id, attempts)
+                continue
+            try:
+                store.save_analysis_result(api_id, results[api_id])
+                self.queue.complete(job_id)
+            except Exception as e:
+                logging.error(f"Error saving analysis for API ID {api_id} (attempt {attempts}): {e}")
+                self.queue.fail(job_id, attempts, str(e), self.max_attempts)
+        logging.info(f"Analyzed API IDs: {[api_id for _, api_id, _ in jobs if api_id in results]}")
+
+
+_worker_pools = {}
+_worker_pools_lock = threading.Lock()
+
+
+def get_worker_pool(analyzer, db_path='api_security.db'):
+    # One pool per database for the whole process, so workers outlive Streamlit reruns
+    with _worker_pools_lock:
+        if db_path not in _worker_pools:
+            _worker_pools[db_path] = AnalysisWorkerPool(analyzer, db_path)
+        return _worker_pools[db_path]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Analyze captured APIs in the background")
+    parser.add_argument('--db', default='api_security.db')
+    parser.add_argument('--model', default='gemma2:latest')
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=1, help="related APIs packed into one prompt")
+    parser.add_argument('--unanalyzed', action='store_true', help="queue every endpoint without an analysis")
+    parser.add_argument('--important', action='store_true', help="queue every important API without an analysis")
+    args = parser.parse_args()
+
+    from llm import APISecurityAnalyzer
+    pool = AnalysisWorkerPool(APISecurityAnalyzer(args.model, args.db), args.db, args.concurrency, args.max_attempts,
+                              batch_size=args.batch_size)
+    if args.unanalyzed:
+        logging.info(f"Queued {pool.queue.enqueue_unanalyzed()} unanalyzed endpoints")
+    if args.important:
+        logging.info(f"Queued {pool.queue.enqueue_important()} important APIs")
+    pool.start()
+    try:
+        progress = pool.wait_until_drained()
+    finally:
+        pool.stop()
+    logging.info(f"Analysis finished: {progress}")
+
+
+if __name__ == "__main__":
+    main()
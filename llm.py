@@ -1,18 +1,24 @@
-from langchain.llms import Ollama
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from llm_backends import get_llm_runner, LLMRunner
+from context import compact_body, estimate_tokens, truncate_to_tokens
+from schemas import prompt_body
+from metrics import metrics
+from database import connect
+from store import migrate_database
+import hashlib
+import json
 import logging
+import threading
+import time
+from collections import deque
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Bump a version whenever its template text changes so cached responses are not reused
+ANALYSIS_PROMPT_VERSION = 2
+CHAT_PROMPT_VERSION = 1
+SUMMARY_PROMPT_VERSION = 1
+BATCH_ANALYSIS_PROMPT_VERSION = 1
 
-class APISecurityAnalyzer:
-    def __init__(self, model_name="gemma2:latest"):
-        self.llm = Ollama(model=model_name)
-
-    def analyze_vulnerability(self, request, response):
-        prompt_template = PromptTemplate(
-            input_variables=["method", "url", "req_headers", "req_body", "res_status", "res_headers", "res_body"],
-            template="""
+ANALYSIS_TEMPLATE = """
             Analyze the following API call request and response from security perspective:
 
             Request:
@@ -26,6 +32,9 @@ class APISecurityAnalyzer:
             Headers: {res_headers}
             Body: {res_body}
 
+            Similar APIs from the same application that were already analyzed (reuse what applies, don't repeat them):
+            {examples}
+
             Generate security test case specific to this API based on the context from parameters and API path. Only include mostly likely test cases not the generic one's.
             Also suggest possible attacks
 
@@ -34,39 +43,401 @@ class APISecurityAnalyzer:
             - Do not include anything in response other than security test cases.
 
             """
+
+CHAT_TEMPLATE = """
+            You are an AI assistant specialized in API security analysis. 
+            Use the following context to provide a helpful response:
+
+            {context}
+
+            AI: """
+
+SUMMARY_TEMPLATE = """
+            You are summarizing a conversation about the security of a single API call.
+            Merge the existing summary and the new messages into one concise summary.
+            Keep findings, payloads tried, open questions and decisions. Drop pleasantries.
+
+            Existing summary:
+            {summary}
+
+            New messages:
+            {messages}
+
+            Summary: """
+
+BATCH_ANALYSIS_TEMPLATE = """
+            Analyze the following related API calls from a security perspective. They were captured from the same
+            application, so also look for issues that only show up across them, such as IDOR between sibling routes,
+            inconsistent authorization or identifiers leaked by one call and accepted by another.
+
+            {endpoints}
+
+            For each API call generate security test cases specific to it based on the context from parameters and
+            API path. Only include mostly likely test cases not the generic one's. Also suggest possible attacks.
+
+            Instruction:
+            - Respond with a JSON array only, no other text.
+            - Include exactly one object per API call: {{"api_id": <id>, "test_cases": ["...", "..."]}}
+            - Put cross-endpoint test cases under every API call they involve.
+
+            """
+
+BATCH_ENDPOINT_TEMPLATE = """
+            API call {api_id}:
+            Request:
+            Method: {method}
+            URL: {url}
+            Headers: {req_headers}
+            Body: {req_body}
+
+            Response:
+            Status: {res_status}
+            Headers: {res_headers}
+            Body: {res_body}
+            """
+
+# Built once per process and shared by every analyzer
+ANALYSIS_PROMPT = PromptTemplate(
+    input_variables=["method", "url", "req_headers", "req_body", "res_status", "res_headers", "res_body"],
+    template=ANALYSIS_TEMPLATE
+)
+CHAT_PROMPT = PromptTemplate(input_variables=["context"], template=CHAT_TEMPLATE)
+SUMMARY_PROMPT = PromptTemplate(input_variables=["summary", "messages"], template=SUMMARY_TEMPLATE)
+BATCH_ANALYSIS_PROMPT = PromptTemplate(input_variables=["endpoints"], template=BATCH_ANALYSIS_TEMPLATE)
+
+# Per-response noise only: anything the analysis judges (cookies and their flags, reporting policies) stays in the key
+VOLATILE_HEADERS = {
+    'date', 'age', 'expires', 'last-modified', 'etag', 'server-timing', 'x-runtime',
+    'x-request-id', 'x-requestid', 'request-id', 'x-correlation-id', 'x-amzn-requestid', 'x-amz-request-id',
+    'x-amz-id-2', 'x-amzn-trace-id', 'x-b3-traceid', 'x-b3-spanid', 'traceparent', 'tracestate', 'cf-ray',
+    'x-cache', 'x-served-by', 'x-timer', 'via',
+}
+
+
+def strip_volatile_headers(headers):
+    if isinstance(headers, dict):
+        return {name: value for name, value in headers.items() if name.lower() not in VOLATILE_HEADERS}
+    if not isinstance(headers, str):
+        return headers
+    try:
+        parsed = json.loads(headers)
+    except ValueError:
+        return headers
+    if isinstance(parsed, dict):
+        return json.dumps(strip_volatile_headers(parsed), sort_keys=True)
+    return headers
+
+
+def parse_batch_analysis(response, api_ids):
+    # Returns {api_id: bullet list} for every id the model answered; anything unparseable is left out
+    start, end = response.find('['), response.rfind(']')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        items = json.loads(response[start:end + 1])
+    except ValueError:
+        return {}
+    results = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            api_id = int(item.get('api_id'))
+        except (TypeError, ValueError):
+            continue
+        test_cases = item.get('test_cases')
+        if isinstance(test_cases, str):
+            test_cases = [test_cases]
+        if api_id not in api_ids or not isinstance(test_cases, list) or not test_cases:
+            continue
+        results[api_id] = '\n'.join(f"- {str(case).lstrip('-* ').strip()}" for case in test_cases)
+    return results
+
+
+def normalize_prompt(prompt):
+    # Volatile headers are stripped by callers from the headers themselves (see key_inputs), never from the prompt
+    return ' '.join(prompt.split())
+
+
+class ResponseCache:
+    def __init__(self, db_path='api_security.db', ttl=7 * 24 * 3600, max_entries=5000, evict_every=50):
+        self.conn = connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        migrate_database(self.conn)
+
+    def make_key(self, model, template_version, prompt):
+        digest = hashlib.sha256(normalize_prompt(prompt).encode('utf-8')).hexdigest()
+        return f"{model}:{template_version}:{digest}"
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,))
+            result = cursor.fetchone()
+            if result is None or now - result[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return result[0]
+
+    def put(self, key, model, template_version, response):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO llm_cache (key, model, template_version, response, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key, model, template_version, response, now, now))
+            self.puts += 1
+            if self.puts % self.evict_every == 0:
+                self.evict(now)
+            self.conn.commit()
+
+    def evict(self, now):
+        self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        self.conn.execute('''
+        DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
         )
+        ''', (self.max_entries,))
 
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
-        
-        return chain.run({
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'entries': entries,
+        }
+
+
+class CallStats:
+    def __init__(self, max_calls=200):
+        self.calls = deque(maxlen=max_calls)
+        self.lock = threading.Lock()
+
+    def record(self, kind, model, started, first_token_at, finished, tokens, cached, prompt_tokens=0):
+        total = finished - started
+        generation = finished - (first_token_at or finished)
+        stats = {
+            'kind': kind,
+            'model': model,
+            'cached': cached,
+            'prompt_tokens': prompt_tokens,
+            'tokens': tokens,
+            'ttft_ms': round(((first_token_at or finished) - started) * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'tokens_per_sec': round(tokens / generation, 1) if generation > 0 else 0.0,
+        }
+        with self.lock:
+            self.calls.append(stats)
+        metrics.inc('llm_calls_total', kind=kind, cached=str(cached).lower())
+        if not cached:
+            metrics.observe('llm_latency_ms', stats['total_ms'], kind=kind)
+            metrics.observe('llm_ttft_ms', stats['ttft_ms'], kind=kind)
+            metrics.inc('llm_prompt_tokens_total', prompt_tokens, kind=kind)
+            metrics.inc('llm_completion_tokens_total', tokens, kind=kind)
+        logging.info(f"LLM {kind} call: {stats}")
+        return stats
+
+    def recent(self):
+        with self.lock:
+            return list(self.calls)
+
+
+# Per-call latency for every model call in this process
+call_stats = CallStats()
+
+_response_caches = {}
+_response_caches_lock = threading.Lock()
+
+
+def get_response_cache(db_path='api_security.db'):
+    # One cache per database for the whole process, so counters survive Streamlit reruns
+    with _response_caches_lock:
+        if db_path not in _response_caches:
+            _response_caches[db_path] = ResponseCache(db_path)
+        return _response_caches[db_path]
+
+
+class APISecurityAnalyzer:
+    def __init__(self, model_name="gemma2:latest", cache_path='api_security.db', backend=None,
+                 batch_token_budget=6000, batch_body_tokens=300):
+        self.model_name = model_name
+        self.batch_token_budget = batch_token_budget
+        self.batch_body_tokens = batch_body_tokens
+        # Shared per-model runner by default; an explicit backend (e.g. FakeBackend) gets its own
+        self.runner = LLMRunner(backend) if backend is not None else get_llm_runner(model_name)
+        self.cache = get_response_cache(cache_path) if cache_path else None
+
+    def cache_key(self, template_version, prompt, inputs, key_inputs=None):
+        key_prompt = prompt.format(**(key_inputs or inputs))
+        return self.cache.make_key(self.model_name, template_version, key_prompt)
+
+    def cached_run(self, kind, template_version, prompt, inputs, key_inputs=None):
+        started = time.perf_counter()
+        key = self.cache_key(template_version, prompt, inputs, key_inputs) if self.cache else None
+        response = self.cache.get(key) if key else None
+        if response is not None:
+            logging.info(f"LLM cache hit: {key}")
+            now = time.perf_counter()
+            call_stats.record(kind, self.model_name, started, now, now, 0, True)
+            return response
+        full_prompt = prompt.format(**inputs)
+        response = self.runner.generate(full_prompt)
+        # Without streaming the first token arrives with the last one
+        call_stats.record(kind, self.model_name, started, None, time.perf_counter(), estimate_tokens(response), False,
+                          estimate_tokens(full_prompt))
+        if key:
+            self.cache.put(key, self.model_name, template_version, response)
+        return response
+
+    def cached_stream(self, kind, template_version, prompt, inputs, key_inputs=None):
+        started = time.perf_counter()
+        key = self.cache_key(template_version, prompt, inputs, key_inputs) if self.cache else None
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            logging.info(f"LLM cache hit: {key}")
+            now = time.perf_counter()
+            call_stats.record(kind, self.model_name, started, now, now, 0, True)
+            yield cached
+            return
+        first_token_at = None
+        chunks = []
+        full_prompt = prompt.format(**inputs)
+        for chunk in self.runner.stream(full_prompt):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks.append(chunk)
+            yield chunk
+        call_stats.record(kind, self.model_name, started, first_token_at, time.perf_counter(), len(chunks), False,
+                          estimate_tokens(full_prompt))
+        if key:
+            self.cache.put(key, self.model_name, template_version, ''.join(chunks))
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else {}
+
+    def backend_stats(self):
+        return self.runner.stats()
+
+    def analysis_inputs(self, request, response, examples=''):
+        inputs = {
             "method": request['method'],
             "url": request['url'],
             "req_headers": request['headers'],
-            "req_body": request['body'],
+            "req_body": prompt_body(request['body'], request.get('schema')),
             "res_status": response['status'],
             "res_headers": response['headers'],
-            "res_body": response['body']
-        })
+            "res_body": prompt_body(response['body'], response.get('schema')),
+            "examples": examples or "None yet."
+        }
+        # Examples and endpoint schemas change as more APIs are captured and analyzed; an answer for the
+        # same call stays reusable
+        key_inputs = dict(inputs,
+                          req_headers=strip_volatile_headers(inputs['req_headers']),
+                          req_body=request['body'],
+                          res_headers=strip_volatile_headers(inputs['res_headers']),
+                          res_body=response['body'],
+                          examples='')
+        return inputs, key_inputs
 
-    def chat(self, api_id, context):
-        prompt_template = PromptTemplate(
-            input_variables=["context"],
-            template="""
-            You are an AI assistant specialized in API security analysis. 
-            Use the following context to provide a helpful response:
+    def analyze_vulnerability(self, request, response, examples=''):
+        inputs, key_inputs = self.analysis_inputs(request, response, examples)
+        return self.cached_run('analysis', ANALYSIS_PROMPT_VERSION, ANALYSIS_PROMPT, inputs, key_inputs)
 
-            {context}
+    def stream_vulnerability_analysis(self, request, response, examples=''):
+        inputs, key_inputs = self.analysis_inputs(request, response, examples)
+        yield from self.cached_stream('analysis', ANALYSIS_PROMPT_VERSION, ANALYSIS_PROMPT, inputs, key_inputs)
 
-            AI: """
-        )
+    def batch_entry(self, api_id, request, response):
+        inputs, key_inputs = self.analysis_inputs(request, response)
+        headers_tokens = self.batch_body_tokens // 2
+        entry = dict(inputs,
+                     api_id=api_id,
+                     req_headers=truncate_to_tokens(str(inputs['req_headers'] or ''), headers_tokens),
+                     req_body=compact_body(inputs['req_body'], self.batch_body_tokens),
+                     res_headers=truncate_to_tokens(str(inputs['res_headers'] or ''), headers_tokens),
+                     res_body=compact_body(inputs['res_body'], self.batch_body_tokens))
+        key_entry = dict(entry,
+                         req_headers=truncate_to_tokens(str(key_inputs['req_headers'] or ''), headers_tokens),
+                         req_body=compact_body(key_inputs['req_body'], self.batch_body_tokens),
+                         res_headers=truncate_to_tokens(str(key_inputs['res_headers'] or ''), headers_tokens),
+                         res_body=compact_body(key_inputs['res_body'], self.batch_body_tokens))
+        return BATCH_ENDPOINT_TEMPLATE.format(**entry), BATCH_ENDPOINT_TEMPLATE.format(**key_entry)
 
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
-        
+    def pack_batches(self, calls):
+        # Greedily fills each prompt up to the token budget, keeping the caller's order so siblings stay together
+        budget = self.batch_token_budget - estimate_tokens(BATCH_ANALYSIS_TEMPLATE)
+        batches, batch, used = [], [], 0
+        for api_id, request, response in calls:
+            entry, key_entry = self.batch_entry(api_id, request, response)
+            cost = estimate_tokens(entry)
+            if batch and used + cost > budget:
+                batches.append(batch)
+                batch, used = [], 0
+            batch.append((api_id, request, response, entry, key_entry))
+            used += cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def analyze_batch(self, calls):
+        # calls is [(api_id, request, response)]; returns {api_id: analysis}, one model call per packed batch
+        results = {}
+        for batch in self.pack_batches(calls):
+            if len(batch) == 1:
+                api_id, request, response = batch[0][:3]
+                results[api_id] = self.analyze_vulnerability(request, response)
+                continue
+            api_ids = {item[0] for item in batch}
+            inputs = {"endpoints": ''.join(item[3] for item in batch)}
+            key_inputs = {"endpoints": ''.join(item[4] for item in batch)}
+            try:
+                parsed = parse_batch_analysis(
+                    self.cached_run('batch', BATCH_ANALYSIS_PROMPT_VERSION, BATCH_ANALYSIS_PROMPT, inputs, key_inputs), api_ids)
+            except Exception as e:
+                logging.error(f"Batch analysis of {len(batch)} APIs failed: {e}")
+                parsed = {}
+            logging.info(f"Batch analysis parsed {len(parsed)} of {len(batch)} APIs")
+            results.update(parsed)
+            # Anything the model skipped or garbled falls back to one prompt per call
+            for api_id, request, response, _, _ in batch:
+                if api_id not in parsed:
+                    results[api_id] = self.analyze_vulnerability(request, response)
+        return results
+
+    def chat(self, api_id, context, key_context=None):
         logging.info(f"API ID: {api_id}")
-        logging.info(f"Context sent to LLM: {context}")
+        # Context and responses can hold captured secrets and run to thousands of tokens
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Context sent to LLM: {context}")
         
-        response = chain.run(context=context)
+        response = self.cached_run('chat', CHAT_PROMPT_VERSION, CHAT_PROMPT, {"context": context},
+                                   {"context": key_context or context})
         
-        logging.info(f"LLM Response: {response}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"LLM Response: {response}")
         
-        return response
\ No newline at end of file
+        return response
+
+    def stream_chat(self, api_id, context, key_context=None):
+        logging.info(f"API ID: {api_id}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Context sent to LLM: {context}")
+        yield from self.cached_stream('chat', CHAT_PROMPT_VERSION, CHAT_PROMPT, {"context": context},
+                                      {"context": key_context or context})
+
+    def summarize_chat(self, summary, turns):
+        messages = '\n'.join(f"{'User' if is_user else 'AI'}: {message}" for _, message, is_user in turns)
+        return self.cached_run('summary', SUMMARY_PROMPT_VERSION, SUMMARY_PROMPT,
+                               {"summary": summary or "(none)", "messages": messages})
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import httpx
+
+DEFAULT_OLLAMA_HOST = 'http://localhost:11434'
+DEFAULT_TIMEOUT = 300.0
+STREAM_DONE = object()
+
+# httpx logs every request at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+def ollama_base_url(base_url=None):
+    base_url = (base_url or os.environ.get('OLLAMA_HOST', DEFAULT_OLLAMA_HOST)).rstrip('/')
+    return base_url if '://' in base_url else f"http://{base_url}"
+
+
+class LLMBackend:
+    name = 'base'
+
+    async def generate(self, prompt):
+        raise NotImplementedError
+
+    async def stream(self, prompt):
+        yield await self.generate(prompt)
+
+    async def aclose(self):
+        pass
+
+
+class OllamaBackend(LLMBackend):
+    name = 'ollama'
+
+    def __init__(self, model, base_url=None, timeout=DEFAULT_TIMEOUT):
+        self.model = model
+        self.base_url = ollama_base_url(base_url)
+        self.timeout = timeout
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use so it binds to the runner's event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=httpx.Timeout(self.timeout, connect=10.0))
+        return self._client
+
+    async def generate(self, prompt):
+        response = await self.client.post('/api/generate', json={'model': self.model, 'prompt': prompt, 'stream': False})
+        response.raise_for_status()
+        return response.json().get('response', '')
+
+    async def stream(self, prompt):
+        payload = {'model': self.model, 'prompt': prompt, 'stream': True}
+        async with self.client.stream('POST', '/api/generate', json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get('error'):
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+                if data.get('response'):
+                    yield data['response']
+                if data.get('done'):
+                    break
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class FakeBackend(LLMBackend):
+    name = 'fake'
+
+    def __init__(self, token_delay=0.0, tokens=24):
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.calls = 0
+
+    def response_tokens(self, prompt):
+        # Same prompt, same answer
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return [f"{digest[i % 64:i % 64 + 4]} " for i in range(0, self.tokens * 4, 4)]
+
+    async def generate(self, prompt):
+        return ''.join([token async for token in self.stream(prompt)])
+
+    async def stream(self, prompt):
+        self.calls += 1
+        for token in self.response_tokens(prompt):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield token
+
+
+class _Broadcast:
+    def __init__(self):
+        self.chunks = []
+        self.subscribers = []
+        self.done = False
+        self.error = None
+
+
+class LLMRunner:
+    # Owns an event loop thread; sync callers submit prompts, identical in-flight prompts share one model call
+    def __init__(self, backend, concurrency=2, timeout=DEFAULT_TIMEOUT):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.calls = 0
+        self.coalesced = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=f"llm-{backend.name}", daemon=True)
+        self.thread.start()
+        self._semaphore = None
+        self._in_flight = {}
+        self._in_flight_streams = {}
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def prompt_key(self, prompt):
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def generate(self, prompt):
+        return asyncio.run_coroutine_threadsafe(self.agenerate(prompt), self.loop).result()
+
+    async def agenerate(self, prompt):
+        key = self.prompt_key(prompt)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate(prompt))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _generate(self, prompt):
+        async with self.semaphore:
+            self.calls += 1
+            return await asyncio.wait_for(self.backend.generate(prompt), self.timeout)
+
+    def stream(self, prompt):
+        chunks = queue.Queue()
+        asyncio.run_coroutine_threadsafe(self._subscribe(prompt, chunks), self.loop).result()
+        while True:
+            chunk = chunks.get()
+            if chunk is STREAM_DONE:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+    async def _subscribe(self, prompt, chunks):
+        key = self.prompt_key(prompt)
+        broadcast = self._in_flight_streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._in_flight_streams[key] = broadcast
+            asyncio.ensure_future(self._produce(key, prompt, broadcast))
+        else:
+            self.coalesced += 1
+        # Late subscribers replay what has been generated so far
+        for chunk in broadcast.chunks:
+            chunks.put(chunk)
+        if broadcast.done:
+            chunks.put(broadcast.error or STREAM_DONE)
+        else:
+            broadcast.subscribers.append(chunks)
+
+    async def _produce(self, key, prompt, broadcast):
+        try:
+            async with self.semaphore:
+                self.calls += 1
+                deadline = time.monotonic() + self.timeout
+                tokens = self.backend.stream(prompt).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(tokens.__anext__(), max(deadline - time.monotonic(), 0))
+                    except StopAsyncIteration:
+                        break
+                    broadcast.chunks.append(chunk)
+                    for subscriber in broadcast.subscribers:
+                        subscriber.put(chunk)
+        except Exception as e:
+            logging.error(f"LLM stream failed: {e!r}")
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            self._in_flight_streams.pop(key, None)
+            for subscriber in broadcast.subscribers:
+                subscriber.put(broadcast.error or STREAM_DONE)
+
+    def stats(self):
+        return {
+            'backend': self.backend.name,
+            'concurrency': self.concurrency,
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight) + len(self._in_flight_streams),
+        }
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.backend.aclose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+_runners = {}
+_runners_lock = threading.Lock()
+
+
+def get_llm_runner(model_name):
+    # One runner per model for the whole process, so every UI session and worker shares its concurrency limit
+    with _runners_lock:
+        if model_name not in _runners:
+            if os.environ.get('APIGPT_LLM_BACKEND', 'ollama') == 'fake':
+                backend = FakeBackend()
+            else:
+                backend = OllamaBackend(model_name, timeout=float(os.environ.get('APIGPT_LLM_TIMEOUT', DEFAULT_TIMEOUT)))
+            _runners[model_name] = LLMRunner(
+                backend,
+                concurrency=int(os.environ.get('APIGPT_LLM_CONCURRENCY', 2)),
+                timeout=float(os.environ.get('APIGPT_LLM_TIMEOUT', DEFAULT_TIMEOUT))
+            )
+        return _runners[model_name]
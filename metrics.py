@@ -0,0 +1,189 @@
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in milliseconds, shared by every histogram so Prometheus output stays comparable
+DEFAULT_BUCKETS_MS = (0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def load_snapshot(conn, process):
+    row = conn.execute("SELECT data, updated_at FROM metrics_snapshots WHERE process = ?", (process,)).fetchone()
+    if row is None:
+        return None
+    return dict(json.loads(row[0]), updated_at=row[1])
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS, reservoir=1024):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        # Recent samples for percentiles in the UI; the buckets cover the whole lifetime
+        self.recent = deque(maxlen=reservoir)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def percentile(self, fraction):
+        samples = sorted(self.recent)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        # Decorator; labels default to op=<function name>
+        def decorator(function):
+            op_labels = labels or {'op': function.__name__}
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **op_labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self.lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items()) + sorted(self.gauges.items())
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram.count,
+                    'mean_ms': round(histogram.sum / histogram.count, 3) if histogram.count else 0.0,
+                    'p50_ms': round(histogram.percentile(0.5), 3),
+                    'p99_ms': round(histogram.percentile(0.99), 3),
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        return {'counters': counters, 'histograms': histograms}
+
+    def render_prometheus(self, prefix='apigpt_'):
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f"# TYPE {prefix}{name} {kind}")
+                    for (value_name, labels), value in sorted(values.items()):
+                        if value_name == name:
+                            lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                        cumulative += count
+                        lines.append(f"{prefix}{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{prefix}{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{prefix}{name}_sum{format_labels(labels)} {round(histogram.sum, 3)}")
+                    lines.append(f"{prefix}{name}_count{format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def save_snapshot(self, conn, process):
+        # Lets the UI show metrics from another process, e.g. the proxy
+        conn.execute("INSERT OR REPLACE INTO metrics_snapshots (process, data, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+                     (process, json.dumps(self.snapshot())))
+        conn.commit()
+
+
+class Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.elapsed_ms = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.elapsed_ms = (time.perf_counter() - self.start) * 1000
+        self.registry.observe(self.name, self.elapsed_ms, **self.labels)
+        if exc_type is not None:
+            self.registry.inc(f"{self.name.removesuffix('_ms')}_errors_total", **self.labels)
+        return False
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(registry, port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
+
+
+# One registry per process
+metrics = MetricsRegistry()
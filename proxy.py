@@ -1,77 +1,96 @@
 import mitmproxy.http
 import sqlite3
 import json
-from urllib.parse import urlparse
 import logging
-import re
+import os
+import time
+from capture import CaptureWriter, flow_body, split_url
+from bodystore import DEFAULT_MAX_CAPTURE_BYTES
+from whitelist import DomainMatcher
+from detectors import SecretScanner, DEFAULT_BUDGET_MS
+from capture_filters import CaptureFilter
+from metrics import metrics, serve_metrics
+from database import connect
+from store import migrate_database
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# basicConfig is a no-op once anything has configured logging, so the level is set on the root logger directly
+logging.getLogger().setLevel(os.environ.get('APIGPT_LOG_LEVEL', 'INFO').upper())
+
+# Seconds between metric snapshots written for the app's Performance panel
+METRICS_SNAPSHOT_INTERVAL = 10.0
 
 class APISecurityProxy:
     def __init__(self, db_path='api_security.db'):
-        self.conn = sqlite3.connect(db_path)
-        self.create_table()
+        self.conn = connect(db_path)
+        # Same schema and migrations as the app, whichever process opens the database first
+        migrate_database(self.conn)
         self.debug_mode = False
-        self.whitelisted_domains = self.load_whitelisted_domains()
+        self.matcher = DomainMatcher(self.conn)
+        self.filter = CaptureFilter(self.conn)
+        max_capture_bytes = int(os.environ.get('APIGPT_MAX_CAPTURE_BYTES', DEFAULT_MAX_CAPTURE_BYTES))
+        # 0 turns capture-time secret detection off; detectors.py can still scan afterwards
+        scan_budget_ms = float(os.environ.get('APIGPT_SCAN_BUDGET_MS', DEFAULT_BUDGET_MS))
+        scanner = SecretScanner(budget_ms=scan_budget_ms) if scan_budget_ms > 0 else None
+        self.writer = CaptureWriter(db_path, max_capture_bytes=max_capture_bytes, scanner=scanner)
+        self.last_snapshot = time.monotonic()
+        metrics_port = int(os.environ.get('APIGPT_PROXY_METRICS_PORT', 0))
+        self.metrics_server = serve_metrics(metrics, metrics_port) if metrics_port else None
 
-    def load_whitelisted_domains(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT domain FROM whitelisted_domains")
-        return [row[0] for row in cursor.fetchall()]
+    def response(self, flow: mitmproxy.http.HTTPFlow):
+        with metrics.timer('proxy_response_ms'):
+            captured = self.capture(flow)
+        metrics.inc('proxy_flows_total', result='captured' if captured else 'skipped')
+        if time.monotonic() - self.last_snapshot >= METRICS_SNAPSHOT_INTERVAL:
+            self.save_metrics()
 
-    def create_table(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS api_calls (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            method TEXT,
-            url TEXT,
-            request_headers TEXT,
-            request_body TEXT,
-            response_status INTEGER,
-            response_headers TEXT,
-            response_body TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        self.conn.commit()
+    def capture(self, flow):
+        request, response = flow.request, flow.response
+        url = request.url
+        scheme, host, path, query = split_url(url)
+        if not (self.debug_mode or self.is_domain_whitelisted(host)):
+            self.filter.count('not_whitelisted')
+            return False
+        # Decide on raw sizes and headers before decoding or serializing anything
+        body_bytes = max(len(request.raw_content or b''), len(response.raw_content or b''))
+        if not self.filter.check(request.method, host, path, response.status_code,
+                                 response.headers.get('content-type', ''), body_bytes):
+            return False
+        try:
+            row = (
+                request.method,
+                url,
+                json.dumps(dict(request.headers)),
+                flow_body(request),
+                response.status_code,
+                json.dumps(dict(response.headers)),
+                flow_body(response),
+                scheme, host, path, query
+            )
+            # A full queue is counted in the writer's dropped stat
+            return self.writer.submit(row)
+        except Exception as e:
+            logging.error(f"Error capturing API call: {e}")
+            return False
 
-    def request(self, flow: mitmproxy.http.HTTPFlow):
-        logging.info(f"Intercepted request: {flow.request.method} {flow.request.url}")
+    def save_metrics(self):
+        self.last_snapshot = time.monotonic()
+        writer_stats = self.writer.stats()
+        metrics.set_gauge('capture_queue_depth', writer_stats['queue_depth'])
+        try:
+            metrics.save_snapshot(self.conn, 'proxy')
+        except sqlite3.Error as e:
+            logging.error(f"Error saving proxy metrics: {e}")
 
-    def response(self, flow: mitmproxy.http.HTTPFlow):
-        domain = urlparse(flow.request.url).netloc
-        logging.info(f"Intercepted response: {flow.request.method} {flow.request.url} - Status: {flow.response.status_code}")
-        
-        if self.is_domain_whitelisted(domain) or self.debug_mode:
-            logging.info(f"Capturing domain: {domain}")
-            try:
-                cursor = self.conn.cursor()
-                cursor.execute('''
-                INSERT INTO api_calls (method, url, request_headers, request_body, response_status, response_headers, response_body)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    flow.request.method,
-                    flow.request.url,
-                    json.dumps(dict(flow.request.headers)),
-                    flow.request.content.decode('utf-8', 'ignore'),
-                    flow.response.status_code,
-                    json.dumps(dict(flow.response.headers)),
-                    flow.response.content.decode('utf-8', 'ignore')
-                ))
-                self.conn.commit()
-                logging.info(f"Successfully captured API call: {flow.request.method} {flow.request.url}")
-            except sqlite3.Error as e:
-                logging.error(f"Database error: {e}")
-            except Exception as e:
-                logging.error(f"Error capturing API call: {e}")
-        else:
-            logging.info(f"Domain not whitelisted, skipping capture: {domain}")
+    def done(self):
+        self.filter.report()
+        self.save_metrics()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        self.writer.close()
+        self.conn.close()
 
     def is_domain_whitelisted(self, domain):
-        for whitelisted_domain in self.whitelisted_domains:
-            if re.match(f"^{re.escape(whitelisted_domain).replace('\\*', '.*')}$", domain):
-                return True
-        return False
+        return self.matcher.is_whitelisted(domain)
 
 addons = [APISecurityProxy()]
\ No newline at end of file
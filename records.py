@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+
+SUMMARY_COLUMNS = ('id', 'method', 'url', 'host', 'response_status', 'timestamp', 'is_important', 'endpoint_id')
+DETAIL_COLUMNS = ('request_headers', 'request_body', 'response_headers', 'response_body')
+
+
+class APICallSummary:
+    __slots__ = SUMMARY_COLUMNS + ('is_analyzed', 'analysis_result', 'chat_count')
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        for name in self.__slots__[len(values):]:
+            setattr(self, name, None)
+
+    def __repr__(self):
+        return f"APICallSummary(id={self.id}, method={self.method!r}, url={self.url!r})"
+
+
+class EndpointSummary:
+    __slots__ = ('id', 'method', 'host', 'path_template', 'param_shape', 'hit_count', 'last_seen',
+                 'analysis_api_id', 'analysis_result')
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"EndpointSummary(id={self.id}, method={self.method!r}, path_template={self.path_template!r})"
+
+
+class SimilarEndpoint(EndpointSummary):
+    __slots__ = ('score',)
+
+    def __init__(self, *values):
+        # Endpoint columns followed by the cosine score
+        for name, value in zip(EndpointSummary.__slots__ + self.__slots__, values):
+            setattr(self, name, value)
+
+
+class FindingSummary:
+    __slots__ = ('id', 'api_id', 'kind', 'severity', 'location', 'preview', 'method', 'url')
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"FindingSummary(id={self.id}, api_id={self.api_id}, kind={self.kind!r})"
+
+
+class BodyCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        value = value or ''
+        cost = len(value)
+        if cost > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = value
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def invalidate(self, api_id=None):
+        with self.lock:
+            if api_id is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            for key in [key for key in self.entries if key[0] == api_id]:
+                self.size -= len(self.entries.pop(key))
@@ -0,0 +1,225 @@
+import argparse
+import json
+import logging
+import os
+
+from database import connect
+
+# Bodies bigger than this (or truncated at capture) are left out of the endpoint's schema
+MAX_SCHEMA_BODY_BYTES = 1024 * 1024
+MAX_DEPTH = 8
+# Map-like objects keyed by ids would otherwise grow the schema with every flow
+MAX_PROPERTIES = 64
+# Items of an array share one schema, so a sample of them is enough
+ARRAY_SAMPLE = 20
+MAX_ENUM_VALUES = 8
+MAX_ENUM_LENGTH = 32
+MAX_EXAMPLE_LENGTH = 40
+# Off sends raw (compacted) bodies to the model as before
+PROMPT_SCHEMAS = os.environ.get('APIGPT_PROMPT_SCHEMAS', '1') != '0'
+
+TYPE_NAMES = {bool: 'boolean', int: 'integer', float: 'number', str: 'string', dict: 'object', list: 'array',
+              type(None): 'null'}
+SCHEMA_PARTS = ('request', 'response')
+
+
+def parse_json_body(body):
+    # None unless the body is a JSON object or array
+    if not body or len(body) > MAX_SCHEMA_BODY_BYTES:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    if body.lstrip()[:1] not in ('{', '['):
+        return None
+    try:
+        return json.loads(body)
+    except (ValueError, RecursionError):
+        # Deeply nested bodies overflow the parser; they get no schema rather than failing the capture batch
+        return None
+
+
+def observe(node, value, depth=0):
+    # Folds one value into a schema node in place; cost is proportional to the value, not the schema
+    type_name = TYPE_NAMES.get(type(value), 'string')
+    types = node.setdefault('types', {})
+    types[type_name] = types.get(type_name, 0) + 1
+    if depth >= MAX_DEPTH:
+        return node
+    if type_name == 'object':
+        properties = node.setdefault('properties', {})
+        for key, item in value.items():
+            if key in properties or len(properties) < MAX_PROPERTIES:
+                observe(properties.setdefault(key, {}), item, depth + 1)
+            else:
+                node['more_properties'] = True
+    elif type_name == 'array':
+        items = node.setdefault('items', {})
+        for item in value[:ARRAY_SAMPLE]:
+            observe(items, item, depth + 1)
+    elif type_name != 'null':
+        if 'example' not in node:
+            node['example'] = value[:MAX_EXAMPLE_LENGTH] if type_name == 'string' else value
+        # Distinct short values until there are too many to be an enum; None marks that
+        values = node.get('values', [])
+        if values is not None and value not in values:
+            if type_name in ('string', 'integer', 'boolean') and len(values) < MAX_ENUM_VALUES and \
+                    (type_name != 'string' or len(value) <= MAX_ENUM_LENGTH):
+                values.append(value)
+            else:
+                values = None
+        node['values'] = values
+    return node
+
+
+def infer(value):
+    return observe({}, value)
+
+
+def seen_count(node):
+    return sum(node.get('types', {}).values())
+
+
+def render_type(node, depth=0):
+    types = node.get('types', {})
+    parts = []
+    values = node.get('values')
+    # Repeated values from a small set look like an enum; a handful of one-off values does not
+    is_enum = values and seen_count(node) - types.get('null', 0) >= 2 * len(values) and 'boolean' not in types
+    for type_name in sorted(types, key=types.get, reverse=True):
+        if type_name == 'null':
+            continue
+        if type_name == 'object':
+            parts.append(render_object(node, depth))
+        elif type_name == 'array':
+            parts.append(f"[{render_type(node.get('items', {}), depth + 1) or 'any'}]")
+        elif is_enum and type_name in ('string', 'integer'):
+            parts.append('|'.join(json.dumps(value) for value in sorted(
+                value for value in values if TYPE_NAMES[type(value)] == type_name)))
+        elif 'example' in node and type_name == TYPE_NAMES.get(type(node['example'])) and type_name != 'boolean':
+            parts.append(f"{type_name} (e.g. {json.dumps(node['example'])})")
+        else:
+            parts.append(type_name)
+    if 'null' in types:
+        parts.append('null')
+    return ' | '.join(parts)
+
+
+def render_object(node, depth):
+    if depth >= MAX_DEPTH or not node.get('properties'):
+        return '{}' if not node.get('more_properties') else '{...}'
+    total = node['types'].get('object', 0)
+    fields = []
+    for key, child in node['properties'].items():
+        # A field missing from some of the objects is optional
+        optional = '?' if seen_count(child) < total else ''
+        fields.append(f"{key}{optional}: {render_type(child, depth + 1)}")
+    if node.get('more_properties'):
+        fields.append('...')
+    return '{' + ', '.join(fields) + '}'
+
+
+def render_schema(node):
+    return render_type(node)
+
+
+def prompt_body(body, schema=None):
+    # A JSON body goes to the model as its endpoint's schema when that is shorter than the body itself
+    if not body or not PROMPT_SCHEMAS or body.lstrip()[:1] not in ('{', '['):
+        return body or ''
+    if schema is None:
+        value = parse_json_body(body)
+        if value is None:
+            return body
+        schema = infer(value)
+    samples = seen_count(schema)
+    text = f"JSON {render_schema(schema)}" + (f" (schema of {samples} bodies, ? = optional)" if samples > 1 else '')
+    return text if len(text) < len(body) else body
+
+
+class SchemaStore:
+    def update_many(self, conn, bodies):
+        # bodies: [(endpoint_id, part, raw body)]. Runs inside the caller's transaction, which holds the
+        # write lock, so reading, merging and writing back the touched schemas can't interleave with another writer.
+        values = {}
+        for endpoint_id, part, body in bodies:
+            value = parse_json_body(body) if endpoint_id is not None else None
+            if value is not None:
+                values.setdefault((endpoint_id, part), []).append(value)
+        if not values:
+            return 0
+        endpoint_ids = sorted({endpoint_id for endpoint_id, _ in values})
+        schemas = {}
+        for start in range(0, len(endpoint_ids), 500):
+            chunk = endpoint_ids[start:start + 500]
+            cursor = conn.execute(f'''
+            SELECT endpoint_id, part, schema FROM endpoint_schemas WHERE endpoint_id IN ({', '.join('?' for _ in chunk)})
+            ''', chunk)
+            schemas.update(((endpoint_id, part), json.loads(schema)) for endpoint_id, part, schema in cursor)
+        for key, observed in values.items():
+            schema = schemas.setdefault(key, {})
+            for value in observed:
+                observe(schema, value)
+        conn.executemany('''
+        INSERT OR REPLACE INTO endpoint_schemas (endpoint_id, part, schema, updated_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', [(endpoint_id, part, json.dumps(schemas[(endpoint_id, part)], separators=(',', ':')))
+              for endpoint_id, part in values])
+        return len(values)
+
+    def load(self, conn, endpoint_id):
+        schemas = dict.fromkeys(SCHEMA_PARTS)
+        if endpoint_id is None:
+            return schemas
+        cursor = conn.execute("SELECT part, schema FROM endpoint_schemas WHERE endpoint_id = ?", (endpoint_id,))
+        schemas.update((part, json.loads(schema)) for part, schema in cursor)
+        return schemas
+
+    def delete(self, conn):
+        conn.execute("DELETE FROM endpoint_schemas")
+
+
+def rebuild_schemas(conn, batch_size=500):
+    # For calls captured before schemas were recorded; starts every endpoint's schema over
+    from bodystore import BodyStore
+    body_store = BodyStore()
+    schema_store = SchemaStore()
+    with conn:
+        schema_store.delete(conn)
+    cursor = conn.cursor()
+    last_id = 0
+    total = 0
+    while True:
+        cursor.execute('''
+        SELECT id, endpoint_id, request_body, request_body_hash, response_body, response_body_hash
+        FROM api_calls WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        bodies = []
+        for _, endpoint_id, request_body, request_hash, response_body, response_hash in rows:
+            bodies.append((endpoint_id, 'request', body_store.load(conn, request_hash) if request_hash else request_body))
+            bodies.append((endpoint_id, 'response', body_store.load(conn, response_hash) if response_hash else response_body))
+        with conn:
+            schema_store.update_many(conn, bodies)
+        total += len(rows)
+        last_id = rows[-1][0]
+    return total
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Rebuild per-endpoint JSON body schemas from captured API calls")
+    parser.add_argument('--db', default='api_security.db')
+    args = parser.parse_args()
+    from store import migrate_database
+    conn = connect(args.db)
+    migrate_database(conn)
+    total = rebuild_schemas(conn)
+    schemas = conn.execute("SELECT COUNT(*) FROM endpoint_schemas").fetchone()[0]
+    conn.close()
+    logging.info(f"Read {total} API calls into {schemas} endpoint body schemas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import logging
+import re
+from bodystore import BodyStore
+
+# Bodies are indexed up to this many characters each; the rest is still stored, just not searchable
+MAX_INDEXED_CHARS = 64 * 1024
+
+SEARCH_COLUMNS = ('url', 'request_headers', 'request_body', 'response_headers', 'response_body')
+# bm25 weights in SEARCH_COLUMNS order, a hit in the URL ranks above one deep in a body
+SEARCH_WEIGHTS = (4.0, 1.0, 1.0, 1.0, 1.0)
+
+FTS_FIELDS = {
+    'url': ('url',),
+    'path': ('url',),
+    'header': ('request_headers', 'response_headers'),
+    'headers': ('request_headers', 'response_headers'),
+    'body': ('request_body', 'response_body'),
+    'req': ('request_headers', 'request_body'),
+    'request': ('request_headers', 'request_body'),
+    'resp': ('response_headers', 'response_body'),
+    'response': ('response_headers', 'response_body'),
+}
+
+QUERY_TERM = re.compile(r'(?:(\w+):)?("[^"]*"|\S+)')
+
+
+def fts_phrase(term):
+    prefix = term.endswith('*')
+    term = term.rstrip('*')
+    if not term:
+        return None
+    phrase = '"' + term.replace('"', '""') + '"'
+    return phrase + ' *' if prefix else phrase
+
+
+def parse_query(query):
+    # host:, status:, method:, finding: filter api_calls columns; url:, header:, body:, req:, resp: scope the text match
+    match_terms = []
+    filters = []
+    params = []
+    for field, value in QUERY_TERM.findall(query or ''):
+        field = field.lower()
+        value = value.strip('"')
+        if not value:
+            continue
+        if field == 'host':
+            value = value.lower()
+            if value.startswith('*.'):
+                filters.append("a.host LIKE ?")
+                params.append(f"%{value[1:]}")
+            else:
+                filters.append("(a.host = ? OR a.host LIKE ?)")
+                params.extend([value, f"{value}:%"])
+        elif field == 'status':
+            if re.fullmatch(r'[1-5]xx', value.lower()):
+                filters.append("a.response_status BETWEEN ? AND ?")
+                params.extend([int(value[0]) * 100, int(value[0]) * 100 + 99])
+            elif value.isdigit():
+                filters.append("a.response_status = ?")
+                params.append(int(value))
+        elif field in ('finding', 'secret'):
+            if value.lower() == 'any':
+                filters.append("EXISTS (SELECT 1 FROM findings f WHERE f.api_id = a.id)")
+            else:
+                filters.append("EXISTS (SELECT 1 FROM findings f WHERE f.api_id = a.id AND f.kind = ?)")
+                params.append(value.lower())
+        elif field == 'method':
+            filters.append("a.method = ?")
+            params.append(value.upper())
+        else:
+            phrase = fts_phrase(value)
+            if phrase is None:
+                continue
+            columns = FTS_FIELDS.get(field)
+            if columns:
+                match_terms.append(f"{{{' '.join(columns)}}} : {phrase}")
+            else:
+                # Unknown prefixes like "Bearer:" are searched as plain text
+                match_terms.append(fts_phrase(f"{field}:{value}" if field else value))
+    return ' AND '.join(match_terms), filters, params
+
+
+class SearchIndex:
+    def __init__(self, max_indexed_chars=MAX_INDEXED_CHARS):
+        self.max_indexed_chars = max_indexed_chars
+
+    def exists(self, conn):
+        cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'api_search'")
+        return cursor.fetchone() is not None
+
+    def body_text(self, body):
+        # Raw bytes from the capture writer, or text already resolved from the body store
+        if not body:
+            return ''
+        if isinstance(body, str):
+            return '' if body.startswith('[binary body') else body[:self.max_indexed_chars]
+        chunk = body[:self.max_indexed_chars]
+        try:
+            return chunk.decode('utf-8')
+        except UnicodeDecodeError as e:
+            # The cut can split the last multi-byte character; anything earlier is binary
+            if e.start < len(chunk) - 3:
+                return ''
+            return chunk[:e.start].decode('utf-8')
+
+    def index_many(self, conn, rows):
+        # rows are (api_id, url, request_headers, request_body, response_headers, response_body), bodies raw bytes
+        conn.executemany(
+            f"INSERT OR REPLACE INTO api_search (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (api_id, url or '', request_headers or '', self.body_text(request_body),
+                 response_headers or '', self.body_text(response_body))
+                for api_id, url, request_headers, request_body, response_headers, response_body in rows
+            ]
+        )
+
+    def delete(self, conn, api_id=None):
+        if not self.exists(conn):
+            return
+        if api_id is None:
+            conn.execute("DELETE FROM api_search")
+        else:
+            conn.execute("DELETE FROM api_search WHERE rowid = ?", (api_id,))
+
+    def backfill(self, conn, batch_size=2000):
+        # Rows captured before the index existed, everything above the highest indexed id
+        body_store = BodyStore()
+        cursor = conn.cursor()
+        last_id = cursor.execute("SELECT COALESCE(MAX(rowid), 0) FROM api_search").fetchone()[0]
+        indexed = 0
+        while True:
+            cursor.execute('''
+            SELECT id, url, request_headers, request_body, request_body_hash,
+                   response_headers, response_body, response_body_hash
+            FROM api_calls WHERE id > ? ORDER BY id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            self.index_many(conn, [
+                (api_id, url, request_headers,
+                 body_store.load(conn, request_hash) if request_hash else request_body,
+                 response_headers,
+                 body_store.load(conn, response_hash) if response_hash else response_body)
+                for api_id, url, request_headers, request_body, request_hash,
+                    response_headers, response_body, response_hash in rows
+            ])
+            conn.commit()
+            indexed += len(rows)
+            last_id = rows[-1][0]
+        if indexed:
+            logging.info(f"Indexed {indexed} captured API calls for search")
@@ -0,0 +1,287 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the thread lock guards the index, so run one writing process there
+    fcntl = None
+
+import httpx
+import numpy as np
+
+from database import connect
+from llm_backends import ollama_base_url
+
+# 128 float32s per endpoint keeps a brute-force scan of 100k endpoints to about 50 MB of memory traffic
+DEFAULT_EMBED_DIM = 128
+DEFAULT_EMBED_MODEL = 'nomic-embed-text'
+TOKEN_PATTERN = re.compile(r'[a-z]+|[0-9]+')
+CAMEL_BOUNDARY = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+
+
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def endpoint_text(method, host, path_template, param_shape):
+    path = (path_template or '/').replace('{id}', 'id')
+    return f"{method} {host} {path} params: {(param_shape or '').replace(',', ' ')}"
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(CAMEL_BOUNDARY.sub(' ', text).lower())
+
+
+class HashingEmbedder:
+    # No model to download: hashed word and word-pair features, good enough for matching API shapes
+    name = 'hashing'
+
+    def __init__(self, dim=DEFAULT_EMBED_DIM):
+        self.dim = dim
+        self.signature = f"hashing:{dim}"
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+                vectors[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        return normalize_rows(vectors)
+
+
+class OllamaEmbedder:
+    name = 'ollama'
+
+    def __init__(self, model=DEFAULT_EMBED_MODEL, base_url=None, dim=DEFAULT_EMBED_DIM, timeout=60.0):
+        self.model = model
+        self.dim = dim
+        self.signature = f"ollama:{model}:{dim}"
+        self.client = httpx.Client(base_url=ollama_base_url(base_url), timeout=timeout)
+        self.projection = None
+
+    def project(self, vectors):
+        # Fixed random projection down to the index size; cosine similarities are roughly preserved
+        if vectors.shape[1] <= self.dim:
+            return normalize_rows(vectors)
+        if self.projection is None or self.projection.shape[0] != vectors.shape[1]:
+            rng = np.random.default_rng(0)
+            self.projection = rng.standard_normal((vectors.shape[1], self.dim)).astype(np.float32)
+        return normalize_rows(vectors @ self.projection)
+
+    def embed(self, texts):
+        response = self.client.post('/api/embed', json={'model': self.model, 'input': list(texts)})
+        response.raise_for_status()
+        return self.project(np.asarray(response.json()['embeddings'], dtype=np.float32))
+
+
+def get_embedder():
+    dim = int(os.environ.get('APIGPT_EMBED_DIM', DEFAULT_EMBED_DIM))
+    if os.environ.get('APIGPT_EMBED_BACKEND', 'hashing') == 'ollama':
+        return OllamaEmbedder(os.environ.get('APIGPT_EMBED_MODEL', DEFAULT_EMBED_MODEL), dim=dim)
+    return HashingEmbedder(dim)
+
+
+class VectorIndex:
+    # Append-only float32 rows and their ids in two flat files, memory-mapped for search
+    def __init__(self, directory, dim, signature):
+        self.directory = directory
+        self.dim = dim
+        self.signature = signature
+        self.vectors_path = os.path.join(directory, 'vectors.f32')
+        self.ids_path = os.path.join(directory, 'ids.i64')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.lock_path = os.path.join(directory, 'index.lock')
+        self.lock = threading.RLock()
+        self.lock_depth = 0
+        self.lock_file = None
+        self.generation = None
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.rows = {}
+        os.makedirs(directory, exist_ok=True)
+        with self.locked():
+            meta = self.read_meta() or {}
+            if meta.get('signature') != signature or meta.get('dim') != dim:
+                self.reset()
+            self.load()
+
+    @contextmanager
+    def locked(self):
+        # The UI, proxy and analysis workers are separate processes sharing these files: the thread lock
+        # covers this process, an flock on the lock file covers the others. Re-entrant within a thread.
+        with self.lock:
+            if self.lock_depth == 0 and fcntl:
+                self.lock_file = open(self.lock_path, 'a')
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0 and self.lock_file:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+                    self.lock_file.close()
+                    self.lock_file = None
+
+    def read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def clear(self, generation):
+        self.generation = generation
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.rows = {}
+
+    def reset(self):
+        with self.locked():
+            # A new generation tells other processes to drop what they have loaded
+            generation = (self.read_meta() or {}).get('generation', 0) + 1
+            # Unlinked rather than truncated: other processes may still have the old files memory-mapped
+            for path in (self.vectors_path, self.ids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            with open(f"{self.meta_path}.tmp", 'w') as f:
+                json.dump({'signature': self.signature, 'dim': self.dim, 'generation': generation}, f)
+            os.replace(f"{self.meta_path}.tmp", self.meta_path)
+            self.clear(generation)
+
+    def stored_rows(self):
+        # ids are written after vectors, so complete rows are the ones present in both files
+        count = os.path.getsize(self.ids_path) // 8 if os.path.exists(self.ids_path) else 0
+        if os.path.exists(self.vectors_path):
+            return min(count, os.path.getsize(self.vectors_path) // (self.dim * 4))
+        return 0
+
+    def load(self):
+        # Picks up rows appended by any process since the last load, or starts over after a reset
+        with self.locked():
+            generation = (self.read_meta() or {}).get('generation')
+            count = self.stored_rows()
+            if generation != self.generation or count < len(self.ids):
+                self.clear(generation)
+            if count == len(self.ids):
+                return
+            known = len(self.ids)
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(count, self.dim))
+            self.ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(count,))
+            for row in range(known, count):
+                self.rows[int(self.ids[row])] = row
+
+    def __len__(self):
+        return len(self.ids)
+
+    def max_id(self):
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    def add(self, ids, vectors):
+        with self.locked():
+            # Counted from the files, not from what this process last loaded, so rows other processes
+            # appended are kept; only a half-written tail from an interrupted add is cut off
+            count = self.stored_rows()
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(count * self.dim * 4)
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self.ids_path, 'ab') as f:
+                f.truncate(count * 8)
+                f.write(np.asarray(ids, dtype=np.int64).tobytes())
+            self.load()
+
+    def vector(self, item_id):
+        row = self.rows.get(item_id)
+        return None if row is None else np.asarray(self.vectors[row])
+
+    def search(self, query, k=10, exclude=()):
+        vectors, ids = self.vectors, self.ids
+        if not len(ids):
+            return []
+        scores = vectors @ np.asarray(query, dtype=np.float32)
+        take = min(len(ids), k + len(exclude))
+        top = np.argpartition(scores, len(ids) - take)[len(ids) - take:]
+        top = top[np.argsort(-scores[top])]
+        results = [(int(ids[row]), float(scores[row])) for row in top if int(ids[row]) not in exclude]
+        return results[:k]
+
+
+class SimilarityIndex:
+    def __init__(self, db_path='api_security.db', embedder=None, directory=None, batch_size=256):
+        self.db_path = db_path
+        self.embedder = embedder or get_embedder()
+        self.index = VectorIndex(directory or f"{db_path}.vectors", self.embedder.dim, self.embedder.signature)
+        self.batch_size = batch_size
+
+    def sync(self, conn):
+        # Embeds endpoints created since the last sync; endpoint ids only grow, so the highest one is the watermark.
+        # Holds the index lock throughout so two processes don't embed and append the same endpoints.
+        with self.index.locked():
+            self.index.load()
+            added = 0
+            while True:
+                rows = conn.execute('''
+                SELECT id, method, host, path_template, param_shape FROM endpoints WHERE id > ? ORDER BY id LIMIT ?
+                ''', (self.index.max_id(), self.batch_size)).fetchall()
+                if not rows:
+                    break
+                vectors = self.embedder.embed([endpoint_text(*row[1:]) for row in rows])
+                self.index.add([row[0] for row in rows], vectors)
+                added += len(rows)
+            if added:
+                logging.info(f"Embedded {added} endpoints for similarity search")
+            return added
+
+    def similar(self, conn, endpoint_id, k=5):
+        self.sync(conn)
+        query = self.index.vector(endpoint_id)
+        if query is None:
+            return []
+        return self.index.search(query, k, exclude={endpoint_id})
+
+    def reset(self):
+        self.index.reset()
+
+
+_similarity_indexes = {}
+_similarity_indexes_lock = threading.Lock()
+
+
+def get_similarity_index(db_path='api_security.db'):
+    # One index per database for the whole process; the memory map is shared by every session and worker
+    with _similarity_indexes_lock:
+        if db_path not in _similarity_indexes:
+            _similarity_indexes[db_path] = SimilarityIndex(db_path)
+        return _similarity_indexes[db_path]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Embed captured endpoints for similar-API search")
+    parser.add_argument('--db', default='api_security.db')
+    parser.add_argument('--rebuild', action='store_true', help="drop the index and embed every endpoint again")
+    args = parser.parse_args()
+    index = SimilarityIndex(args.db)
+    if args.rebuild:
+        index.reset()
+    conn = connect(args.db)
+    start = time.perf_counter()
+    added = index.sync(conn)
+    conn.close()
+    logging.info(f"Index holds {len(index.index)} endpoints, added {added} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
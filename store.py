@@ -0,0 +1,817 @@
+import logging
+import os
+import sqlite3
+from database import DEFAULT_DB_PATH, connect
+from capture import split_url
+from endpoints import EndpointIndex
+from whitelist import DomainMatcher
+from bodystore import BodyStore
+from search import SearchIndex, SEARCH_COLUMNS, SEARCH_WEIGHTS, parse_query
+from detectors import FindingStore
+from schemas import SchemaStore
+from code_lookup import invalidate_code_analysis_cache
+from capture_filters import load_filter_rules, save_filter_rules
+from metrics import metrics, load_snapshot
+from similarity import get_similarity_index
+from context import truncate_to_tokens
+from records import APICallSummary, EndpointSummary, FindingSummary, SimilarEndpoint, BodyCache, SUMMARY_COLUMNS, DETAIL_COLUMNS
+
+DEFAULT_CODE_ANALYSIS_CONFIG = {
+    'endpoint': 'http://localhost:8000/ask',
+    'parameter': 'question',
+    'value_template': 'From given {endpoint_path} and request body {request_body} identify function in the code which is responsible for the particular API'
+}
+
+# Shared across reruns and sessions, holds headers and bodies loaded on demand
+body_cache = BodyCache()
+SUMMARY_SELECT = ', '.join(SUMMARY_COLUMNS)
+search_index = SearchIndex()
+finding_store = FindingStore()
+schema_store = SchemaStore()
+# Already-analyzed similar endpoints shown to the model as exemplars; 0 turns it off
+SIMILAR_EXAMPLES = int(os.environ.get('APIGPT_SIMILAR_EXAMPLES', 3))
+MIN_EXAMPLE_SCORE = 0.3
+EXAMPLE_TOKENS = 80
+
+
+def create_core_tables(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS api_calls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        method TEXT,
+        url TEXT,
+        request_headers TEXT,
+        request_body TEXT,
+        response_status INTEGER,
+        response_headers TEXT,
+        response_body TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_important BOOLEAN DEFAULT 0,
+        scheme TEXT,
+        host TEXT,
+        path TEXT,
+        query TEXT,
+        request_body_hash TEXT,
+        response_body_hash TEXT,
+        endpoint_id INTEGER
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS whitelisted_domains (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        domain TEXT UNIQUE
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS analysis_results (
+        api_id INTEGER PRIMARY KEY,
+        result TEXT,
+        FOREIGN KEY (api_id) REFERENCES api_calls (id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        api_id INTEGER,
+        message TEXT,
+        is_user BOOLEAN,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (api_id) REFERENCES api_calls (id)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_api_id ON chat_history (api_id, timestamp)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        api_id INTEGER PRIMARY KEY,
+        summary TEXT,
+        summarized_until INTEGER,
+        FOREIGN KEY (api_id) REFERENCES api_calls (id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS code_analysis_config (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        endpoint TEXT,
+        parameter TEXT,
+        value_template TEXT
+    )
+    ''')
+
+    # Check if code_analysis_config table is empty and insert default values if needed
+    cursor.execute('SELECT COUNT(*) FROM code_analysis_config')
+    if cursor.fetchone()[0] == 0:
+        default_config = DEFAULT_CODE_ANALYSIS_CONFIG
+        cursor.execute('''
+        INSERT INTO code_analysis_config (id, endpoint, parameter, value_template)
+        VALUES (1, ?, ?, ?)
+        ''', (default_config['endpoint'], default_config['parameter'], default_config['value_template']))
+
+    conn.commit()
+    migrate_api_calls(conn)
+    create_capture_tables(conn)
+    EndpointIndex().backfill(conn)
+    if create_search_table(conn):
+        search_index.backfill(conn)
+
+
+API_CALL_COLUMNS = {
+    'is_important': 'BOOLEAN DEFAULT 0',
+    'scheme': 'TEXT',
+    'host': 'TEXT',
+    'path': 'TEXT',
+    'query': 'TEXT',
+    'request_body_hash': 'TEXT',
+    'response_body_hash': 'TEXT',
+    'endpoint_id': 'INTEGER',
+}
+
+API_CALL_INDEXES = {
+    'idx_api_calls_host_id': 'api_calls (host, id)',
+    'idx_api_calls_is_important': 'api_calls (is_important)',
+    'idx_api_calls_endpoint_id': 'api_calls (endpoint_id, id)',
+}
+
+
+def create_api_call_indexes(conn):
+    for name, definition in API_CALL_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    conn.commit()
+
+
+def drop_api_call_indexes(conn):
+    # Bulk loads rebuild them once at the end instead of updating them per row
+    for name in API_CALL_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+
+def migrate_api_calls(conn, batch_size=5000):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(api_calls)")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, definition in API_CALL_COLUMNS.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE api_calls ADD COLUMN {column} {definition}")
+    conn.commit()
+
+    backfilled = 0
+    last_id = 0
+    while True:
+        cursor.execute("SELECT id, url FROM api_calls WHERE host IS NULL AND id > ? ORDER BY id LIMIT ?",
+                       (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany("UPDATE api_calls SET scheme = ?, host = ?, path = ?, query = ? WHERE id = ?",
+                           [split_url(url or '') + (api_id,) for api_id, url in rows])
+        conn.commit()
+        backfilled += len(rows)
+        last_id = rows[-1][0]
+    if backfilled:
+        logging.info(f"Backfilled URL columns for {backfilled} captured API calls")
+    create_api_call_indexes(conn)
+
+
+def create_capture_tables(conn):
+    # Written by the proxy's capture writer alongside api_calls
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS bodies (
+        hash TEXT PRIMARY KEY,
+        codec TEXT,
+        size INTEGER,
+        truncated BOOLEAN DEFAULT 0,
+        data BLOB
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS endpoints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        method TEXT,
+        host TEXT,
+        path_template TEXT,
+        param_shape TEXT,
+        hit_count INTEGER DEFAULT 0,
+        first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        analysis_api_id INTEGER,
+        UNIQUE (method, host, path_template, param_shape)
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_endpoints_last_seen ON endpoints (last_seen)")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS findings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        api_id INTEGER,
+        kind TEXT,
+        severity TEXT,
+        location TEXT,
+        offset INTEGER,
+        preview TEXT,
+        value_hash TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (api_id) REFERENCES api_calls (id)
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_findings_kind_api_id ON findings (kind, api_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_findings_api_id ON findings (api_id)")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS capture_filter_rules (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS capture_stats (
+        reason TEXT PRIMARY KEY,
+        count INTEGER DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS metrics_snapshots (
+        process TEXT PRIMARY KEY,
+        data TEXT,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.commit()
+
+
+def create_search_table(conn):
+    try:
+        conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS api_search USING fts5({', '.join(SEARCH_COLUMNS)})
+        ''')
+        # Weighted bm25 as the table's rank, so ORDER BY rank stays inside FTS5
+        conn.execute(f"INSERT INTO api_search (api_search, rank) VALUES ('rank', 'bm25({', '.join(map(str, SEARCH_WEIGHTS))})')")
+        conn.commit()
+        return True
+    except sqlite3.OperationalError as e:
+        logging.warning(f"Full-text search disabled, SQLite has no FTS5: {e}")
+        return False
+
+
+def create_code_analysis_cache_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS code_analysis_cache (
+        method TEXT,
+        path_template TEXT,
+        config_hash TEXT,
+        answer TEXT,
+        api_id INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (method, path_template, config_hash)
+    )
+    ''')
+    conn.commit()
+
+
+def create_schema_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS endpoint_schemas (
+        endpoint_id INTEGER,
+        part TEXT,
+        schema TEXT,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (endpoint_id, part)
+    )
+    ''')
+    conn.commit()
+
+
+def create_job_and_cache_tables(conn):
+    # Used to be created by the LLM response cache and the job queue themselves
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        model TEXT,
+        template_version INTEGER,
+        response TEXT,
+        created_at REAL,
+        last_used REAL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        api_id INTEGER,
+        status TEXT DEFAULT 'queued',
+        attempts INTEGER DEFAULT 0,
+        error TEXT,
+        next_attempt_at REAL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs (status, next_attempt_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_api_id ON analysis_jobs (api_id)")
+    conn.commit()
+
+
+# Every table, index and column lives here. Each entry runs once per database, in order, and
+# PRAGMA user_version records the last one applied. Version 1 is the baseline: every statement is
+# idempotent so databases from before versioning upgrade in place.
+MIGRATIONS = [
+    (1, create_core_tables),
+    (2, create_code_analysis_cache_table),
+    (3, create_schema_table),
+    (4, create_job_and_cache_tables),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate_database(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    for target, migration in MIGRATIONS:
+        if version < target:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+            logging.info(f"Migrated database schema to version {target}")
+
+
+class APIStore:
+    def __init__(self, db_path=DEFAULT_DB_PATH, analyzer=None, conn=None, read_conn=None):
+        self.db_path = db_path
+        self.body_store = BodyStore()
+        self.analyzer = analyzer
+        if conn is None:
+            self.conn = connect(db_path)
+            self.init_database()
+        else:
+            # Shared connection whose schema the owner has already initialized
+            self.conn = conn
+        # Reads can go through a separate read-only connection so browsing never waits on writes
+        self.read_conn = read_conn or self.conn
+
+    def init_database(self):
+        migrate_database(self.conn)
+
+    def get_code_analysis_config(self):
+        cursor = self.read_conn.cursor()
+        cursor.execute('SELECT endpoint, parameter, value_template FROM code_analysis_config WHERE id = 1')
+        result = cursor.fetchone()
+        if result:
+            return {
+                'endpoint': result[0],
+                'parameter': result[1],
+                'value_template': result[2]
+            }
+        return dict(DEFAULT_CODE_ANALYSIS_CONFIG)
+
+    def save_code_analysis_config(self, endpoint, parameter, value_template):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        INSERT OR REPLACE INTO code_analysis_config (id, endpoint, parameter, value_template)
+        VALUES (1, ?, ?, ?)
+        ''', (endpoint, parameter, value_template))
+        self.conn.commit()
+        invalidate_code_analysis_cache(self.conn, {'endpoint': endpoint, 'parameter': parameter,
+                                                   'value_template': value_template})
+
+    def get_capture_filter_rules(self):
+        return load_filter_rules(self.conn)
+
+    def save_capture_filter_rules(self, rules):
+        save_filter_rules(self.conn, rules)
+
+    def get_capture_stats(self):
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT reason, count FROM capture_stats ORDER BY count DESC")
+        return dict(cursor.fetchall())
+
+    def get_proxy_metrics(self):
+        return load_snapshot(self.read_conn, 'proxy')
+
+    def reset_capture_stats(self):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM capture_stats")
+        self.conn.commit()
+
+    def get_whitelisted_domains(self):
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT domain FROM whitelisted_domains")
+        return [row[0] for row in cursor.fetchall()]
+
+    def add_whitelisted_domain(self, domain):
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO whitelisted_domains (domain) VALUES (?)", (domain,))
+        self.conn.commit()
+
+    def remove_whitelisted_domain(self, domain):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM whitelisted_domains WHERE domain = ?", (domain,))
+        self.conn.commit()
+
+    def clear_captured_apis(self):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM api_calls")
+        cursor.execute("DELETE FROM analysis_results")
+        cursor.execute("DELETE FROM analysis_jobs")
+        cursor.execute("DELETE FROM bodies")
+        cursor.execute("DELETE FROM endpoints")
+        search_index.delete(self.conn)
+        finding_store.delete(self.conn)
+        schema_store.delete(self.conn)
+        self.conn.commit()
+        body_cache.invalidate()
+        get_similarity_index(self.db_path).reset()
+
+    def get_whitelisted_hosts(self):
+        # Walk the distinct captured hosts through the (host, id) index instead of scanning every row
+        cursor = self.read_conn.cursor()
+        cursor.execute("""
+        WITH RECURSIVE hosts(host) AS (
+            SELECT MIN(host) FROM api_calls
+            UNION ALL
+            SELECT (SELECT MIN(host) FROM api_calls WHERE host > hosts.host) FROM hosts WHERE host IS NOT NULL
+        )
+        SELECT host FROM hosts WHERE host IS NOT NULL
+        """)
+        matcher = DomainMatcher(self.read_conn)
+        return [row[0] for row in cursor.fetchall() if matcher.match(row[0])]
+
+    def host_filter(self, column='host'):
+        if not self.get_whitelisted_domains():
+            return "", []
+        hosts = self.get_whitelisted_hosts()
+        if not hosts:
+            return "WHERE 0", []
+        return f"WHERE {column} IN ({', '.join('?' for _ in hosts)})", hosts
+
+    @metrics.timed('db_query_ms')
+    def get_api_calls(self, limit=50, offset=0):
+        cursor = self.read_conn.cursor()
+        where, params = self.host_filter()
+        cursor.execute(f"SELECT {SUMMARY_SELECT} FROM api_calls {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                       params + [limit, offset])
+        return [APICallSummary(*row) for row in cursor.fetchall()]
+
+    @metrics.timed('db_query_ms')
+    def get_api_page(self, limit=50, before_id=None):
+        # Keyset page: rows older than before_id plus analysis state and chat count, in one query
+        where, params = self.host_filter()
+        if before_id is not None:
+            where = f"{where} AND id < ?" if where else "WHERE id < ?"
+            params = params + [before_id]
+        return self.summaries_with_state(
+            f"SELECT {SUMMARY_SELECT} FROM api_calls {where} ORDER BY id DESC LIMIT ?", params + [limit], "a.id DESC"
+        )
+
+    @metrics.timed('db_query_ms')
+    def get_api_calls_since(self, after_id, limit=200):
+        where, params = self.host_filter()
+        where = f"{where} AND id > ?" if where else "WHERE id > ?"
+        return self.summaries_with_state(
+            f"SELECT {SUMMARY_SELECT} FROM api_calls {where} ORDER BY id DESC LIMIT ?",
+            params + [after_id, limit], "a.id DESC"
+        )
+
+    def get_data_version(self):
+        # Changes whenever another connection commits to the database
+        return self.read_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def summaries_with_state(self, inner_query, params, order_by):
+        cursor = self.read_conn.cursor()
+        cursor.execute(f"""
+        SELECT {', '.join(f'a.{column}' for column in SUMMARY_COLUMNS)},
+               COALESCE(r.api_id, er.api_id) IS NOT NULL AS is_analyzed,
+               COALESCE(r.result, er.result) AS analysis_result,
+               (SELECT COUNT(*) FROM chat_history c WHERE c.api_id = a.id) AS chat_count
+        FROM ({inner_query}) a
+        LEFT JOIN analysis_results r ON r.api_id = a.id
+        LEFT JOIN endpoints e ON e.id = a.endpoint_id
+        LEFT JOIN analysis_results er ON er.api_id = e.analysis_api_id
+        ORDER BY {order_by}
+        """, params)
+        return [APICallSummary(*row) for row in cursor.fetchall()]
+
+    @metrics.timed('db_query_ms')
+    def search_api_calls(self, query, limit=50, offset=0):
+        # Text terms go through the FTS index ranked by bm25, field filters narrow the joined rows
+        match, filters, params = parse_query(query)
+        where, host_params = self.host_filter('a.host')
+        if where:
+            filters.append(where[len("WHERE "):])
+            params = params + host_params
+        columns = ', '.join(f'a.{column}' for column in SUMMARY_COLUMNS)
+        if match:
+            conditions = ' AND '.join(["api_search MATCH ?"] + filters)
+            inner_query = f"""
+            SELECT {columns}, api_search.rank AS search_rank
+            FROM api_search JOIN api_calls a ON a.id = api_search.rowid
+            WHERE {conditions}
+            ORDER BY api_search.rank LIMIT ? OFFSET ?
+            """
+            return self.summaries_with_state(inner_query, [match] + params + [limit, offset], "a.search_rank")
+        conditions = f"WHERE {' AND '.join(filters)}" if filters else ""
+        inner_query = f"SELECT {columns} FROM api_calls a {conditions} ORDER BY a.id DESC LIMIT ? OFFSET ?"
+        return self.summaries_with_state(inner_query, params + [limit, offset], "a.id DESC")
+
+    @metrics.timed('db_query_ms')
+    def get_api_detail(self, api_id, field):
+        if field not in DETAIL_COLUMNS:
+            raise ValueError(f"Unknown API call field: {field}")
+        value = body_cache.get((api_id, field))
+        if value is None:
+            cursor = self.read_conn.cursor()
+            if field.endswith('_body'):
+                cursor.execute(f"SELECT {field}, {field}_hash FROM api_calls WHERE id = ?", (api_id,))
+                result = cursor.fetchone()
+                value = self.resolve_body(*result) if result else ''
+            else:
+                cursor.execute(f"SELECT {field} FROM api_calls WHERE id = ?", (api_id,))
+                result = cursor.fetchone()
+                value = result[0] if result and result[0] is not None else ''
+            body_cache.put((api_id, field), value)
+        return value
+
+    def resolve_body(self, inline_body, body_hash):
+        # Rows captured before the body store keep their text inline
+        if body_hash:
+            return self.body_store.load(self.read_conn, body_hash)
+        return inline_body or ''
+
+    @metrics.timed('db_query_ms')
+    def get_chat_histories(self, api_ids):
+        histories = {api_id: [] for api_id in api_ids}
+        if not api_ids:
+            return histories
+        cursor = self.read_conn.cursor()
+        cursor.execute(f"""
+        SELECT api_id, message, is_user FROM chat_history
+        WHERE api_id IN ({', '.join('?' for _ in api_ids)})
+        ORDER BY api_id, timestamp ASC
+        """, list(api_ids))
+        for api_id, message, is_user in cursor.fetchall():
+            histories[api_id].append((message, is_user))
+        return histories
+
+    @metrics.timed('db_query_ms')
+    def get_total_api_calls(self):
+        cursor = self.read_conn.cursor()
+        where, params = self.host_filter()
+        cursor.execute(f"SELECT COUNT(*) FROM api_calls {where}", params)
+        return cursor.fetchone()[0]
+
+    @metrics.timed('db_query_ms')
+    def get_endpoints(self, limit=200):
+        cursor = self.read_conn.cursor()
+        where, params = self.host_filter('e.host')
+        cursor.execute(f"""
+        SELECT e.id, e.method, e.host, e.path_template, e.param_shape, e.hit_count, e.last_seen,
+               e.analysis_api_id, r.result
+        FROM endpoints e
+        LEFT JOIN analysis_results r ON r.api_id = e.analysis_api_id
+        {where}
+        ORDER BY e.hit_count DESC, e.id DESC
+        LIMIT ?
+        """, params + [limit])
+        return [EndpointSummary(*row) for row in cursor.fetchall()]
+
+    def get_endpoint_sample(self, endpoint_id):
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT MAX(id) FROM api_calls WHERE endpoint_id = ?", (endpoint_id,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_endpoint_analysis(self, endpoint_id):
+        if endpoint_id is None:
+            return None
+        cursor = self.read_conn.cursor()
+        cursor.execute('''
+        SELECT r.result FROM endpoints e JOIN analysis_results r ON r.api_id = e.analysis_api_id
+        WHERE e.id = ?
+        ''', (endpoint_id,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    @metrics.timed('db_query_ms')
+    def find_similar_apis(self, api_id, k=5):
+        row = self.read_conn.execute("SELECT endpoint_id FROM api_calls WHERE id = ?", (api_id,)).fetchone()
+        if not row or row[0] is None:
+            return []
+        index = get_similarity_index(self.db_path)
+        where, params = self.host_filter('e.host')
+        # Matches on hosts that are no longer whitelisted are dropped, so ask for more until k remain
+        fetch = k * 4 if where else k
+        while True:
+            matches = dict(index.similar(self.read_conn, row[0], fetch))
+            if not matches:
+                return []
+            cursor = self.read_conn.cursor()
+            cursor.execute(f"""
+            SELECT e.id, e.method, e.host, e.path_template, e.param_shape, e.hit_count, e.last_seen,
+                   e.analysis_api_id, r.result
+            FROM endpoints e
+            LEFT JOIN analysis_results r ON r.api_id = e.analysis_api_id
+            {f"{where} AND" if where else "WHERE"} e.id IN ({', '.join('?' for _ in matches)})
+            """, params + list(matches))
+            similar = [SimilarEndpoint(*row, matches[row[0]]) for row in cursor.fetchall()]
+            if len(similar) >= k or len(matches) < fetch:
+                break
+            fetch *= 4
+        return sorted(similar, key=lambda endpoint: endpoint.score, reverse=True)[:k]
+
+    def analysis_examples(self, api, k=SIMILAR_EXAMPLES):
+        # Short excerpts of analyses for the closest already-analyzed endpoints
+        if not k or api.get('endpoint_id') is None:
+            return ''
+        try:
+            matches = dict(get_similarity_index(self.db_path).similar(self.read_conn, api['endpoint_id'], k * 10))
+        except Exception as e:
+            logging.warning(f"Similar API lookup failed, analyzing without examples: {e}")
+            return ''
+        matches = {endpoint_id: score for endpoint_id, score in matches.items() if score >= MIN_EXAMPLE_SCORE}
+        if not matches:
+            return ''
+        cursor = self.read_conn.cursor()
+        cursor.execute(f"""
+        SELECT e.id, e.method, e.path_template, r.result
+        FROM endpoints e JOIN analysis_results r ON r.api_id = e.analysis_api_id
+        WHERE e.id IN ({', '.join('?' for _ in matches)})
+        """, list(matches))
+        analyzed = sorted(cursor.fetchall(), key=lambda row: matches[row[0]], reverse=True)[:k]
+        return '\n'.join(
+            f"- {method} {path_template}:\n{truncate_to_tokens(result, EXAMPLE_TOKENS)}"
+            for _, method, path_template, result in analyzed
+        )
+
+    @metrics.timed('db_query_ms')
+    def get_finding_counts(self):
+        cursor = self.read_conn.cursor()
+        where, params = self.host_filter('a.host')
+        cursor.execute(f'''
+        SELECT f.kind, f.severity, COUNT(*), COUNT(DISTINCT f.api_id)
+        FROM findings f JOIN api_calls a ON a.id = f.api_id
+        {where}
+        GROUP BY f.kind, f.severity
+        ORDER BY CASE f.severity WHEN 'high' THEN 0 WHEN 'medium' THEN 1 ELSE 2 END, COUNT(*) DESC
+        ''', params)
+        return cursor.fetchall()
+
+    @metrics.timed('db_query_ms')
+    def get_findings(self, kind=None, limit=200):
+        cursor = self.read_conn.cursor()
+        where, params = self.host_filter('a.host')
+        if kind:
+            where = f"{where} AND f.kind = ?" if where else "WHERE f.kind = ?"
+            params = params + [kind]
+        cursor.execute(f'''
+        SELECT f.id, f.api_id, f.kind, f.severity, f.location, f.preview, a.method, a.url
+        FROM findings f JOIN api_calls a ON a.id = f.api_id
+        {where}
+        ORDER BY f.id DESC
+        LIMIT ?
+        ''', params + [limit])
+        return [FindingSummary(*row) for row in cursor.fetchall()]
+
+    @metrics.timed('db_query_ms')
+    def get_important_apis(self):
+        cursor = self.read_conn.cursor()
+        cursor.execute(f"SELECT {SUMMARY_SELECT} FROM api_calls WHERE is_important = 1 ORDER BY id ASC")
+        return [APICallSummary(*row) for row in cursor.fetchall()]
+
+    def toggle_api_importance(self, api_id, is_important):
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE api_calls SET is_important = ? WHERE id = ?", (is_important, api_id))
+        self.conn.commit()
+
+    def remove_api(self, api_id):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE endpoints SET hit_count = hit_count - 1
+        WHERE id = (SELECT endpoint_id FROM api_calls WHERE id = ?)
+        ''', (api_id,))
+        cursor.execute("DELETE FROM api_calls WHERE id = ?", (api_id,))
+        cursor.execute("DELETE FROM analysis_results WHERE api_id = ?", (api_id,))
+        cursor.execute("DELETE FROM analysis_jobs WHERE api_id = ?", (api_id,))
+        search_index.delete(self.conn, api_id)
+        finding_store.delete(self.conn, api_id)
+        self.conn.commit()
+        body_cache.invalidate(api_id)
+
+    def save_analysis_result(self, api_id, analysis):
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT OR REPLACE INTO analysis_results (api_id, result) VALUES (?, ?)", (api_id, analysis))
+        # Every other request to the same endpoint reuses this analysis
+        cursor.execute('''
+        UPDATE endpoints SET analysis_api_id = ?
+        WHERE id = (SELECT endpoint_id FROM api_calls WHERE id = ?)
+        ''', (api_id, api_id))
+        self.conn.commit()
+
+    def get_analysis_result(self, api_id):
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT result FROM analysis_results WHERE api_id = ?", (api_id,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_chat_history(self, api_id):
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT message, is_user FROM chat_history WHERE api_id = ? ORDER BY timestamp ASC", (api_id,))
+        return cursor.fetchall()
+
+    def get_chat_turns(self, api_id):
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT id, message, is_user FROM chat_history WHERE api_id = ? ORDER BY timestamp ASC, id ASC", (api_id,))
+        return cursor.fetchall()
+
+    def get_chat_summary(self, api_id):
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT summary, summarized_until FROM chat_summaries WHERE api_id = ?", (api_id,))
+        result = cursor.fetchone()
+        return result if result else ('', 0)
+
+    def save_chat_summary(self, api_id, summary, summarized_until):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        INSERT OR REPLACE INTO chat_summaries (api_id, summary, summarized_until) VALUES (?, ?, ?)
+        ''', (api_id, summary, summarized_until))
+        self.conn.commit()
+
+    def save_chat_message(self, api_id, message, is_user):
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO chat_history (api_id, message, is_user) VALUES (?, ?, ?)", (api_id, message, is_user))
+        self.conn.commit()
+
+    def clear_chat_history(self, api_id):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM chat_history WHERE api_id = ?", (api_id,))
+        cursor.execute("DELETE FROM chat_summaries WHERE api_id = ?", (api_id,))
+        self.conn.commit()
+
+    @metrics.timed('db_query_ms')
+    def get_api_call(self, api_id):
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT * FROM api_calls WHERE id = ?", (api_id,))
+        columns = [column[0] for column in cursor.description]
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        api_call = dict(zip(columns, row))
+        for field in ('request_body', 'response_body'):
+            api_call[field] = self.resolve_body(api_call[field], api_call[f"{field}_hash"])
+        return api_call
+
+    def get_endpoint_schemas(self, endpoint_id):
+        return schema_store.load(self.read_conn, endpoint_id)
+
+    def analysis_inputs(self, api):
+        schemas = self.get_endpoint_schemas(api.get('endpoint_id'))
+        return (
+            {
+                'method': api['method'],
+                'url': api['url'],
+                'headers': api['request_headers'],
+                'body': api['request_body'],
+                'schema': schemas['request']
+            },
+            {
+                'status': api['response_status'],
+                'headers': api['response_headers'],
+                'body': api['response_body'],
+                'schema': schemas['response']
+            }
+        )
+
+    def analyze_api(self, api):
+        endpoint_analysis = self.get_endpoint_analysis(api.get('endpoint_id'))
+        if endpoint_analysis is not None:
+            logging.info(f"Reusing endpoint analysis for API ID: {api['id']}")
+            return endpoint_analysis
+        return self.analyzer.analyze_vulnerability(*self.analysis_inputs(api), examples=self.analysis_examples(api))
+
+    def analyze_apis(self, apis):
+        # Several APIs in as few prompts as fit the budget; endpoints with an analysis reuse it
+        results = {}
+        pending = []
+        for api in apis:
+            endpoint_analysis = self.get_endpoint_analysis(api.get('endpoint_id'))
+            if endpoint_analysis is not None:
+                logging.info(f"Reusing endpoint analysis for API ID: {api['id']}")
+                results[api['id']] = endpoint_analysis
+            else:
+                pending.append((api['id'], *self.analysis_inputs(api)))
+        if pending:
+            results.update(self.analyzer.analyze_batch(pending))
+        return results
+
+    def stream_analysis(self, api_id):
+        # Yields the analysis as it is generated and saves it once complete
+        api = self.get_api_call(api_id)
+        endpoint_analysis = self.get_endpoint_analysis(api.get('endpoint_id'))
+        if endpoint_analysis is not None:
+            logging.info(f"Reusing endpoint analysis for API ID: {api_id}")
+            chunks = [endpoint_analysis]
+            yield endpoint_analysis
+        else:
+            chunks = []
+            examples = self.analysis_examples(api)
+            for chunk in self.analyzer.stream_vulnerability_analysis(*self.analysis_inputs(api), examples=examples):
+                chunks.append(chunk)
+                yield chunk
+        self.save_analysis_result(api_id, ''.join(chunks))
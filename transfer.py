@@ -0,0 +1,497 @@
+import argparse
+import base64
+import gzip
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from bodystore import BodyStore, DEFAULT_MAX_CAPTURE_BYTES
+from capture import flow_body, insert_rows, split_url
+from detectors import FindingStore, SecretScanner
+from endpoints import EndpointIndex
+from schemas import SchemaStore
+from search import SearchIndex
+from store import create_api_call_indexes, drop_api_call_indexes, migrate_database
+from database import connect
+
+FORMATS = {'.har': 'har', '.flow': 'flow', '.mitm': 'flow', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+SET_TIMESTAMP = "UPDATE api_calls SET timestamp = COALESCE(?, timestamp), is_important = ? WHERE id = ?"
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    for extension, format_name in FORMATS.items():
+        if name.endswith(extension):
+            return format_name
+    raise ValueError(f"Can't tell the format of {path}, pass --format har, flow or jsonl")
+
+
+def open_file(path, mode):
+    # Compressed dumps are read and written as a stream too
+    encoding = None if 'b' in mode else ('utf-8-sig' if 'r' in mode else 'utf-8')
+    opener = gzip.open if path.endswith('.gz') else open
+    return opener(path, mode, encoding=encoding)
+
+
+def utc_timestamp(value):
+    # Same format SQLite's CURRENT_TIMESTAMP writes
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        moment = datetime.fromtimestamp(value, timezone.utc)
+    else:
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def iso_timestamp(value):
+    return f"{value.replace(' ', 'T')}.000Z" if value else None
+
+
+def encode_body(raw):
+    if not raw:
+        return '', None
+    try:
+        return raw.decode('utf-8'), None
+    except UnicodeDecodeError:
+        return base64.b64encode(raw).decode('ascii'), 'base64'
+
+
+def decode_body(text, encoding=None):
+    if not text:
+        return b''
+    if encoding == 'base64':
+        return base64.b64decode(text)
+    return text.encode('utf-8')
+
+
+def merge_headers(pairs):
+    headers = {}
+    for name, value in pairs:
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return headers
+
+
+class JSONStream:
+    # Walks a JSON document incrementally, decoding one value at a time so memory stays at about one chunk
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read(self, size):
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return
+        if self.pos > self.chunk_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        self.buffer += data
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.read(self.chunk_size)
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number running into the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Doubling keeps very large values (e.g. big bodies) linear overall
+            self.read(read_size)
+            read_size *= 2
+
+    def object_keys(self):
+        # Yields each key; the caller must consume the value before asking for the next key
+        self.expect('{')
+        while True:
+            char = self.peek()
+            if char == '}':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+            key = self.value()
+            self.expect(':')
+            yield key
+
+    def array_items(self):
+        self.expect('[')
+        while True:
+            char = self.peek()
+            if char == ']':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+            yield self.value()
+
+
+def read_har(f):
+    stream = JSONStream(f)
+    for key in stream.object_keys():
+        if key != 'log':
+            stream.value()
+            continue
+        for log_key in stream.object_keys():
+            if log_key == 'entries':
+                for entry in stream.array_items():
+                    yield har_record(entry)
+            else:
+                stream.value()
+
+
+def har_record(entry):
+    request, response = entry.get('request', {}), entry.get('response', {})
+    post_data = request.get('postData') or {}
+    request_text = post_data.get('text')
+    if request_text is None and post_data.get('params'):
+        request_text = urlencode([(param.get('name', ''), param.get('value', '')) for param in post_data['params']])
+    content = response.get('content') or {}
+    return {
+        'method': request.get('method', 'GET'),
+        'url': request.get('url', ''),
+        'request_headers': merge_headers((header['name'], header['value']) for header in request.get('headers', [])),
+        'request_body': decode_body(request_text, post_data.get('encoding')),
+        'status': response.get('status', 0),
+        'response_headers': merge_headers((header['name'], header['value']) for header in response.get('headers', [])),
+        'response_body': decode_body(content.get('text'), content.get('encoding')),
+        'timestamp': utc_timestamp(entry.get('startedDateTime')),
+        'is_important': False,
+    }
+
+
+def read_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        yield {
+            'method': item.get('method', 'GET'),
+            'url': item.get('url', ''),
+            'request_headers': item.get('request_headers') or {},
+            'request_body': decode_body(item.get('request_body'), item.get('request_body_encoding')),
+            'status': item.get('status', 0),
+            'response_headers': item.get('response_headers') or {},
+            'response_body': decode_body(item.get('response_body'), item.get('response_body_encoding')),
+            'timestamp': utc_timestamp(item.get('timestamp')),
+            'is_important': bool(item.get('is_important')),
+        }
+
+
+def read_flows(f):
+    from mitmproxy import http, io
+
+    for flow in io.FlowReader(f).stream():
+        if not isinstance(flow, http.HTTPFlow) or flow.response is None:
+            continue
+        yield {
+            'method': flow.request.method,
+            'url': flow.request.url,
+            'request_headers': dict(flow.request.headers),
+            'request_body': flow_body(flow.request),
+            'status': flow.response.status_code,
+            'response_headers': dict(flow.response.headers),
+            'response_body': flow_body(flow.response),
+            'timestamp': utc_timestamp(flow.request.timestamp_start),
+            'is_important': False,
+        }
+
+
+def read_records(path, format_name):
+    if format_name == 'flow':
+        with open_file(path, 'rb') as f:
+            yield from read_flows(f)
+        return
+    with open_file(path, 'rt') as f:
+        yield from read_har(f) if format_name == 'har' else read_jsonl(f)
+
+
+def record_row(record):
+    scheme, host, path, query = split_url(record['url'])
+    # Same layout as the proxy's rows, plus timestamp and importance for the follow-up update
+    return (
+        record['method'],
+        record['url'],
+        json.dumps(record['request_headers']),
+        record['request_body'],
+        record['status'],
+        json.dumps(record['response_headers']),
+        record['response_body'],
+        scheme, host, path, query,
+        record['timestamp'],
+        record['is_important'],
+    )
+
+
+class TrafficImporter:
+    def __init__(self, db_path='api_security.db', batch_size=5000, scanner=None, defer_indexes=True,
+                 max_capture_bytes=DEFAULT_MAX_CAPTURE_BYTES):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.scanner = scanner
+        self.defer_indexes = defer_indexes
+        self.body_store = BodyStore(max_capture_bytes)
+        self.endpoint_index = EndpointIndex()
+        self.finding_store = FindingStore()
+        self.schema_store = SchemaStore()
+        self.search_index = SearchIndex()
+        self.imported = 0
+
+    def import_records(self, records):
+        conn = connect(self.db_path)
+        migrate_database(conn)
+        search_index = self.search_index if self.search_index.exists(conn) else None
+        if self.defer_indexes:
+            drop_api_call_indexes(conn)
+        start = time.perf_counter()
+        try:
+            batch = []
+            for record in records:
+                batch.append(record_row(record))
+                if len(batch) >= self.batch_size:
+                    self.write_batch(conn, batch, search_index)
+                    batch = []
+                    logging.info(f"Imported {self.imported} API calls "
+                                 f"({self.imported / (time.perf_counter() - start):.0f}/s)")
+            if batch:
+                self.write_batch(conn, batch, search_index)
+        finally:
+            if self.defer_indexes:
+                index_start = time.perf_counter()
+                create_api_call_indexes(conn)
+                logging.info(f"Rebuilt api_calls indexes in {time.perf_counter() - index_start:.1f}s")
+            conn.close()
+        logging.info(f"Imported {self.imported} API calls in {time.perf_counter() - start:.1f}s")
+        return self.imported
+
+    def write_batch(self, conn, batch, search_index):
+        findings = [
+            self.scanner.scan({
+                'request_headers': row[2], 'request_body': row[3], 'response_headers': row[5], 'response_body': row[6]
+            })
+            for row in batch
+        ] if self.scanner else []
+        with conn:
+            first_id = insert_rows(conn, batch, self.body_store, self.endpoint_index, findings, self.finding_store,
+                                   search_index, self.schema_store)
+            conn.executemany(SET_TIMESTAMP, [(row[11], row[12], first_id + i) for i, row in enumerate(batch)])
+        self.imported += len(batch)
+
+
+def iter_api_calls(conn, host=None, important_only=False, batch_size=1000):
+    body_store = BodyStore()
+    filters, params = [], []
+    if host:
+        filters.append("host = ?")
+        params.append(host)
+    if important_only:
+        filters.append("is_important = 1")
+    where = ''.join(f" AND {condition}" for condition in filters)
+    last_id = 0
+    while True:
+        rows = conn.execute(f'''
+        SELECT id, method, url, request_headers, request_body, request_body_hash, response_status,
+               response_headers, response_body, response_body_hash, timestamp, is_important
+        FROM api_calls WHERE id > ?{where} ORDER BY id LIMIT ?
+        ''', [last_id] + params + [batch_size]).fetchall()
+        if not rows:
+            return
+        for (api_id, method, url, request_headers, request_body, request_hash, status,
+             response_headers, response_body, response_hash, timestamp, is_important) in rows:
+            yield {
+                'method': method,
+                'url': url,
+                'request_headers': json.loads(request_headers or '{}'),
+                # Rows captured before the body store keep their bodies inline as text
+                'request_body': body_store.load_raw(conn, request_hash)[0] if request_hash
+                else (request_body or '').encode('utf-8'),
+                'status': status,
+                'response_headers': json.loads(response_headers or '{}'),
+                'response_body': body_store.load_raw(conn, response_hash)[0] if response_hash
+                else (response_body or '').encode('utf-8'),
+                'timestamp': timestamp,
+                'is_important': bool(is_important),
+            }
+        last_id = rows[-1][0]
+
+
+def content_type(headers):
+    for name, value in headers.items():
+        if name.lower() == 'content-type':
+            return value
+    return ''
+
+
+def har_entry(record):
+    request_text, request_encoding = encode_body(record['request_body'])
+    response_text, response_encoding = encode_body(record['response_body'])
+    request = {
+        'method': record['method'],
+        'url': record['url'],
+        'httpVersion': 'HTTP/1.1',
+        'headers': [{'name': name, 'value': value} for name, value in record['request_headers'].items()],
+        'queryString': [],
+        'cookies': [],
+        'headersSize': -1,
+        'bodySize': len(record['request_body']),
+    }
+    if record['request_body']:
+        request['postData'] = {'mimeType': content_type(record['request_headers']), 'text': request_text}
+        if request_encoding:
+            request['postData']['encoding'] = request_encoding
+    content = {'size': len(record['response_body']), 'mimeType': content_type(record['response_headers']),
+               'text': response_text}
+    if response_encoding:
+        content['encoding'] = response_encoding
+    return {
+        'startedDateTime': iso_timestamp(record['timestamp']),
+        'time': 0,
+        'request': request,
+        'response': {
+            'status': record['status'],
+            'statusText': '',
+            'httpVersion': 'HTTP/1.1',
+            'headers': [{'name': name, 'value': value} for name, value in record['response_headers'].items()],
+            'cookies': [],
+            'content': content,
+            'redirectURL': '',
+            'headersSize': -1,
+            'bodySize': len(record['response_body']),
+        },
+        'cache': {},
+        'timings': {'send': 0, 'wait': 0, 'receive': 0},
+    }
+
+
+def write_har(f, records):
+    f.write('{"log": {"version": "1.2", "creator": {"name": "API GPT", "version": "1.0"}, "entries": [\n')
+    count = 0
+    for record in records:
+        if count:
+            f.write(',\n')
+        f.write(json.dumps(har_entry(record)))
+        count += 1
+    f.write('\n]}}\n')
+    return count
+
+
+def write_jsonl(f, records):
+    count = 0
+    for record in records:
+        request_body, request_encoding = encode_body(record['request_body'])
+        response_body, response_encoding = encode_body(record['response_body'])
+        item = dict(record, request_body=request_body, response_body=response_body)
+        if request_encoding:
+            item['request_body_encoding'] = request_encoding
+        if response_encoding:
+            item['response_body_encoding'] = response_encoding
+        f.write(json.dumps(item) + '\n')
+        count += 1
+    return count
+
+
+def write_flows(f, records):
+    from mitmproxy import connection, http, io
+
+    writer = io.FlowWriter(f)
+    count = 0
+    for record in records:
+        started = time.time()
+        if record['timestamp']:
+            started = datetime.strptime(record['timestamp'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+        request = http.Request.make(record['method'], record['url'], record['request_body'], record['request_headers'])
+        response = http.Response.make(record['status'], record['response_body'], record['response_headers'])
+        request.timestamp_start = request.timestamp_end = started
+        response.timestamp_start = response.timestamp_end = started
+        flow = http.HTTPFlow(
+            connection.Client(peername=('127.0.0.1', 0), sockname=('127.0.0.1', 0), timestamp_start=started),
+            connection.Server(address=(request.host, request.port)),
+        )
+        flow.request, flow.response = request, response
+        writer.add(flow)
+        count += 1
+    return count
+
+
+def export_api_calls(db_path, path, format_name, host=None, important_only=False):
+    conn = connect(db_path)
+    start = time.perf_counter()
+    try:
+        records = iter_api_calls(conn, host, important_only)
+        if format_name == 'flow':
+            with open_file(path, 'wb') as f:
+                count = write_flows(f, records)
+        else:
+            with open_file(path, 'wt') as f:
+                count = write_har(f, records) if format_name == 'har' else write_jsonl(f, records)
+    finally:
+        conn.close()
+    logging.info(f"Exported {count} API calls to {path} in {time.perf_counter() - start:.1f}s")
+    return count
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Import or export captured traffic as HAR, mitmproxy flows or JSONL")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="load a traffic dump into the database")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--batch-size', type=int, default=5000, help="rows per transaction")
+    import_parser.add_argument('--no-scan', action='store_true', help="skip secret and personal data detection")
+    import_parser.add_argument('--keep-indexes', action='store_true',
+                               help="update indexes per row instead of rebuilding them at the end")
+    export_parser = subparsers.add_parser('export', help="write captured API calls to a file")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--host', help="only this host")
+    export_parser.add_argument('--important-only', action='store_true')
+    for subparser in (import_parser, export_parser):
+        subparser.add_argument('--db', default='api_security.db')
+        subparser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                               help="defaults to the file extension (.har, .flow, .jsonl, optionally .gz)")
+    args = parser.parse_args()
+
+    format_name = args.format or detect_format(args.path)
+    if args.command == 'import':
+        importer = TrafficImporter(args.db, args.batch_size, None if args.no_scan else SecretScanner(),
+                                   defer_indexes=not args.keep_indexes)
+        importer.import_records(read_records(args.path, format_name))
+    else:
+        export_api_calls(args.db, args.path, format_name, args.host, args.important_only)
+
+
+if __name__ == "__main__":
+    main()
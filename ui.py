@@ -3,6 +3,7 @@ from typing import List, Dict, Callable
 import logging
 import re
 import math
+from schemas import render_schema, seen_count
 
 class APISecurityUI:
     def __init__(self):
@@ -10,6 +11,9 @@ class APISecurityUI:
             st.session_state.refresh_key = 0
         if 'page_number' not in st.session_state:
             st.session_state.page_number = 1
+        if 'page_cursors' not in st.session_state:
+            # before_id for each visited page, page 1 starts at the newest row
+            st.session_state.page_cursors = [None]
 
     def format_code_snippets(self, text):
         # Split the text into code and non-code parts
@@ -78,135 +82,387 @@ class APISecurityUI:
             if st.button("Stop Proxy"):
                 app.stop_proxy()
 
+        self.capture_filter_config(app)
+
+        st.subheader("Bulk Analysis")
+        concurrency = st.number_input("Concurrent analyses", min_value=1, max_value=16, value=2, key="bulk_concurrency")
+        batch_size = st.number_input("APIs per prompt", min_value=1, max_value=20, value=6, key="bulk_batch_size",
+                                     help="Related APIs from the same host are analyzed together in one prompt")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Analyze all unanalyzed"):
+                queued = app.start_bulk_analysis('unanalyzed', int(concurrency), int(batch_size))
+                st.success(f"Queued {queued} endpoints for analysis")
+        with col2:
+            if st.button("Analyze all important"):
+                queued = app.start_bulk_analysis('important', int(concurrency), int(batch_size))
+                st.success(f"Queued {queued} important APIs for analysis")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Stop analysis"):
+                app.stop_bulk_analysis()
+        with col2:
+            if st.button("Clear finished jobs"):
+                app.clear_bulk_analysis_jobs()
+        self.bulk_analysis_progress(app)
+
+        st.subheader("LLM Cache")
+        cache_stats = app.get_llm_cache_stats()
+        if cache_stats:
+            st.caption(f"{cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                       f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['entries']} cached responses")
+        recent_calls = [call for call in app.get_llm_call_stats() if not call['cached']]
+        if recent_calls:
+            last_call = recent_calls[-1]
+            st.caption(f"Last {last_call['kind']} call: {last_call['ttft_ms']:.0f} ms to first token, "
+                       f"{last_call['tokens_per_sec']} tokens/s")
+
+        st.subheader("Performance")
+        with st.expander("Latency and counters"):
+            self.performance_panel(app)
+
         if st.button("Clear Captured APIs"):
             app.clear_captured_apis()
+            st.session_state.page_number = 1
+            st.session_state.page_cursors = [None]
             st.success("All captured APIs have been cleared.")
             self.refresh_ui()
 
+    def capture_filter_config(self, app):
+        st.subheader("Capture Filters")
+        stats = app.get_capture_stats()
+        if stats:
+            captured = stats.pop('captured', 0)
+            skipped = ', '.join(f"{count} {reason.replace('_', ' ')}" for reason, count in stats.items())
+            st.caption(f"{captured} captured, skipped: {skipped or 'none'}")
+        with st.expander("Edit capture filters"):
+            rules = app.get_capture_filter_rules()
+            list_rules = {
+                'content_type_allow': "Content types to capture (empty = all)",
+                'content_type_deny': "Content types to skip",
+                'method_deny': "Methods to skip",
+                'path_allow': "Path globs to capture (empty = all)",
+                'path_deny': "Path globs to skip",
+                'status_allow': "Statuses to capture, e.g. 2xx, 401 (empty = all)",
+                'status_deny': "Statuses to skip",
+            }
+            edited = {}
+            for name, label in list_rules.items():
+                value = st.text_input(label, value=', '.join(str(item) for item in rules[name]), key=f"filter_{name}")
+                edited[name] = [item.strip() for item in value.split(',') if item.strip()]
+            edited['max_body_bytes'] = int(st.number_input("Skip flows with bodies over (bytes, 0 = no limit)",
+                                                           min_value=0, value=int(rules['max_body_bytes']),
+                                                           key="filter_max_body_bytes"))
+            edited['sample_per_minute'] = int(st.number_input("Keep first N per endpoint per minute (0 = all)",
+                                                              min_value=0, value=int(rules['sample_per_minute']),
+                                                              key="filter_sample_per_minute"))
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Save Filters"):
+                    app.save_capture_filter_rules(edited)
+                    st.success("Capture filters saved, the proxy picks them up within a second.")
+            with col2:
+                if st.button("Reset Counters"):
+                    app.reset_capture_stats()
+                    self.refresh_ui()
+
+    @st.fragment(run_every=3)
+    def bulk_analysis_progress(self, app):
+        progress = app.get_bulk_analysis_progress()
+        total = progress['queued'] + progress['running'] + progress['done'] + progress['failed']
+        if not total:
+            return
+        finished = progress['done'] + progress['failed']
+        st.progress(finished / total, text=f"{finished}/{total} analyzed, {progress['failed']} failed")
+        st.caption(f"{progress['running']} running, {progress['queued']} queued, "
+                   f"workers {'running' if progress['workers_running'] else 'stopped'}")
+
+    @st.fragment(run_every=5)
+    def performance_panel(self, app):
+        def label(metric):
+            labels = ', '.join(f"{key}={value}" for key, value in metric['labels'].items())
+            return f"{metric['name']} ({labels})" if labels else metric['name']
+
+        sources = [("App", app.get_performance_metrics())]
+        proxy_metrics = app.get_proxy_metrics()
+        if proxy_metrics:
+            sources.append((f"Proxy (as of {proxy_metrics['updated_at']})", proxy_metrics))
+        for title, snapshot in sources:
+            st.caption(title)
+            if not snapshot['histograms'] and not snapshot['counters']:
+                st.caption("Nothing recorded yet")
+                continue
+            if snapshot['histograms']:
+                st.dataframe([
+                    {'metric': label(metric), 'count': metric['count'], 'p50 ms': metric['p50_ms'],
+                     'p99 ms': metric['p99_ms'], 'mean ms': metric['mean_ms']}
+                    for metric in snapshot['histograms']
+                ], hide_index=True, use_container_width=True)
+            if snapshot['counters']:
+                st.dataframe([{'metric': label(metric), 'value': metric['value']} for metric in snapshot['counters']],
+                             hide_index=True, use_container_width=True)
+
     def main_content(self, app):
         st.header("API List")
+        query = st.text_input("Search", key="search_query",
+                              placeholder='access_token host:api.example.com status:4xx method:POST body:"user_id"')
+        view = st.radio("View", ["Requests", "Endpoints", "Findings"], horizontal=True, key="list_view")
+        if query.strip():
+            self.search_results(app, query)
+        elif view == "Endpoints":
+            self.endpoint_list(app)
+        elif view == "Findings":
+            self.finding_list(app)
+        else:
+            self.api_list(app)
 
+        st.header("Important APIs")
+        important_apis = app.get_important_apis()
+        if not important_apis:
+            st.info("No APIs marked as important yet.")
+        else:
+            for api in important_apis:
+                st.write(f"#{api.id}: {api.method} {api.url}")
+            if st.button("Fetch code for all important APIs"):
+                bar = st.progress(0.0, text="Asking the code analysis endpoint...")
+                answers, errors = app.fetch_code_for_important_apis(
+                    lambda done, total: bar.progress(done / total, text=f"{done}/{total} routes looked up")
+                )
+                bar.empty()
+                st.success(f"Code found for {len(answers)} of {len(important_apis)} important APIs")
+                if errors:
+                    st.error(f"{len(errors)} lookups failed: {next(iter(errors.values()))}")
+
+    def api_list(self, app):
         # Pagination
         items_per_page = 50
         total_items = app.get_total_api_calls()
         total_pages = math.ceil(total_items / items_per_page)
         
+        if st.session_state.page_number > len(st.session_state.page_cursors):
+            st.session_state.page_number = len(st.session_state.page_cursors)
+        before_id = st.session_state.page_cursors[st.session_state.page_number - 1]
+        api_calls = app.get_api_page(limit=items_per_page, before_id=before_id)
+
         col1, col2, col3 = st.columns([1, 3, 1])
         with col1:
             if st.button("Previous Page") and st.session_state.page_number > 1:
                 st.session_state.page_number -= 1
+                del st.session_state.page_cursors[st.session_state.page_number:]
                 st.rerun()
         with col2:
             st.write(f"Page {st.session_state.page_number} of {total_pages}")
         with col3:
-            if st.button("Next Page") and st.session_state.page_number < total_pages:
+            if st.button("Next Page") and st.session_state.page_number < total_pages and api_calls:
+                del st.session_state.page_cursors[st.session_state.page_number:]
+                st.session_state.page_cursors.append(api_calls[-1].id)
                 st.session_state.page_number += 1
                 st.rerun()
-        
-        offset = (st.session_state.page_number - 1) * items_per_page
-        api_calls = app.get_api_calls(limit=items_per_page, offset=offset)
 
-        api_calls = app.get_api_calls()
+        if st.session_state.page_number == 1:
+            # Full rerun: the page already holds everything up to its newest row, the feed starts after it
+            st.session_state.live_after_id = api_calls[0].id if api_calls else 0
+            st.session_state.live_rows = []
+            st.session_state.live_data_version = None
+            if st.toggle("Live updates", value=True, key="live_updates"):
+                self.live_feed(app)
+
         if not api_calls:
             st.info("No API calls captured yet. Start the proxy and make some requests to see data here.")
         else:
-            for index, api in enumerate(api_calls, start=1):
-                api_id = api['id']
-                is_analyzed = app.get_analysis_result(api_id) is not None
-                is_important = api['is_important']
-                icon = "✅" if is_analyzed else "🔄"
-                important_icon = "⭐" if is_important else ""
-                with st.expander(f"{icon} {important_icon} #{index}: {api['method']} {api['url']}", expanded=False):
-                    if st.checkbox("Show Request Headers", key=f"headers_{index}"):
-                        st.json(api['request_headers'])
-                    if st.checkbox("Show Request Body", key=f"body_{index}"):
-                        st.text(api['request_body'])
-                    if st.checkbox("Show Response Headers", key=f"resp_headers_{index}"):
-                        st.json(api['response_headers'])
-                    if st.checkbox("Show Response Body", key=f"resp_body_{index}"):
-                        st.text(api['response_body'])
-
-                    col1, col2, col3, col4, col5 = st.columns(5)
-                    with col1:
-                        if not is_analyzed:
-                            if st.button("Analyze", key=f"analyze_{api_id}"):
-                                analysis = app.analyze_api(api)
-                                app.save_analysis_result(api_id, analysis)
-                                st.rerun()
-                        else:
-                            st.success("This API has been analyzed.")
-                    
-                    with col2:
-                        if st.button("Get Code", key=f"get_code_{api_id}"):
-                            logging.info(f"Get Code button clicked for API ID: {api_id}")
-                            method = api['method']
-                            url = api['url']
-                            request_body = api['request_body']
-                            code_analysis = app.get_code_analysis(method, url, request_body)
-                            st.session_state[f"code_analysis_{api_id}"] = code_analysis
-                            st.rerun()           
-                    
-                    with col3:
-                        if st.button("Mark Important" if not is_important else "Unmark Important", key=f"important_{api_id}"):
-                            app.toggle_api_importance(api_id, not is_important)
-                            self.refresh_ui()
+            self.render_api_calls(app, api_calls)
+
+    @st.fragment(run_every=2)
+    def live_feed(self, app):
+        # Reruns on its own; only queries when another connection (the proxy) has committed since the last poll
+        data_version = app.get_data_version()
+        if data_version != st.session_state.live_data_version:
+            st.session_state.live_data_version = data_version
+            new_rows = app.get_api_calls_since(st.session_state.live_after_id)
+            if new_rows:
+                st.session_state.live_rows = (new_rows + st.session_state.live_rows)[:200]
+                st.session_state.live_after_id = new_rows[0].id
+        if st.session_state.live_rows:
+            st.caption(f"{len(st.session_state.live_rows)} new API calls captured")
+            self.render_api_calls(app, st.session_state.live_rows, key_prefix="live_")
+
+    def search_results(self, app, query):
+        items_per_page = 50
+        if st.session_state.get('search_page_query') != query:
+            st.session_state.search_page_query = query
+            st.session_state.search_page = 1
+        offset = (st.session_state.search_page - 1) * items_per_page
+        # One extra row tells whether there is a next page without counting every match
+        api_calls = app.search_api_calls(query, limit=items_per_page + 1, offset=offset)
+        has_next = len(api_calls) > items_per_page
+        api_calls = api_calls[:items_per_page]
+
+        col1, col2, col3 = st.columns([1, 3, 1])
+        with col1:
+            if st.button("Previous Results") and st.session_state.search_page > 1:
+                st.session_state.search_page -= 1
+                st.rerun()
+        with col2:
+            if api_calls:
+                st.write(f"Results {offset + 1}-{offset + len(api_calls)}")
+        with col3:
+            if st.button("Next Results") and has_next:
+                st.session_state.search_page += 1
+                st.rerun()
+
+        if not api_calls:
+            st.info("No captured API calls match this search.")
+        else:
+            self.render_api_calls(app, api_calls)
+
+    def render_api_calls(self, app, api_calls, key_prefix=''):
+        chat_histories = app.get_chat_histories([api.id for api in api_calls if api.chat_count])
+        code_analyses = app.get_cached_code_analyses(api_calls)
+        for index, api in enumerate(api_calls, start=1):
+            api_id = api.id
+            is_analyzed = bool(api.is_analyzed)
+            is_important = api.is_important
+            icon = "✅" if is_analyzed else "🔄"
+            important_icon = "⭐" if is_important else ""
+            with st.expander(f"{icon} {important_icon} #{index}: {api.method} {api.url}", expanded=False):
+                if st.checkbox("Show Request Headers", key=f"{key_prefix}headers_{api_id}"):
+                    st.json(app.get_api_detail(api_id, 'request_headers'))
+                if st.checkbox("Show Request Body", key=f"{key_prefix}body_{api_id}"):
+                    st.text(app.get_api_detail(api_id, 'request_body'))
+                if st.checkbox("Show Response Headers", key=f"{key_prefix}resp_headers_{api_id}"):
+                    st.json(app.get_api_detail(api_id, 'response_headers'))
+                if st.checkbox("Show Response Body", key=f"{key_prefix}resp_body_{api_id}"):
+                    st.text(app.get_api_detail(api_id, 'response_body'))
+                if st.checkbox("Show Body Schemas", key=f"{key_prefix}schemas_{api_id}"):
+                    schemas = app.get_endpoint_schemas(api.endpoint_id)
+                    for part, schema in schemas.items():
+                        if schema:
+                            st.caption(f"{part.capitalize()} bodies ({seen_count(schema)} seen, ? = optional)")
+                            st.code(render_schema(schema), language=None)
+                    if not any(schemas.values()):
+                        st.caption("No JSON bodies captured for this endpoint.")
+                if st.checkbox("Find Similar APIs", key=f"{key_prefix}similar_{api_id}"):
+                    similar = app.find_similar_apis(api_id)
+                    if not similar:
+                        st.caption("No similar APIs captured yet.")
+                    for endpoint in similar:
+                        analyzed = " ✅" if endpoint.analysis_result else ""
+                        st.markdown(f"`{endpoint.score:.2f}` {endpoint.method} {endpoint.host}{endpoint.path_template} "
+                                    f"({endpoint.hit_count} calls){analyzed}")
+
+                col1, col2, col3, col4, col5 = st.columns(5)
+                analyze_clicked = False
+                with col1:
+                    if not is_analyzed:
+                        analyze_clicked = st.button("Analyze", key=f"{key_prefix}analyze_{api_id}")
+                    else:
+                        st.success("This API has been analyzed.")
+                
+                with col2:
+                    has_code = api_id in code_analyses
+                    if st.button("Refresh Code" if has_code else "Get Code", key=f"{key_prefix}get_code_{api_id}"):
+                        logging.info(f"Get Code button clicked for API ID: {api_id}")
+                        method = api.method
+                        url = api.url
+                        request_body = app.get_api_detail(api_id, 'request_body')
+                        code_analysis = app.get_code_analysis(method, url, request_body, api_id, refresh=has_code)
+                        st.session_state[f"code_analysis_{api_id}"] = code_analysis
+                        st.rerun()           
+                
+                with col3:
+                    if st.button("Mark Important" if not is_important else "Unmark Important", key=f"{key_prefix}important_{api_id}"):
+                        app.toggle_api_importance(api_id, not is_important)
+                        self.refresh_ui()
+                
+                with col4:
+                    if st.button("Remove API", key=f"{key_prefix}remove_api_{api_id}"):
+                        app.remove_api(api_id)
+                        self.refresh_ui()
+
+                with col5:
+                    if st.button("Clear Chat", key=f"{key_prefix}clear_chat_{api_id}"):
+                        app.clear_chat_history(api_id)
+                        self.refresh_ui()                            
+
+                # Display code analysis with properly formatted code snippets
+                analysis_text = st.session_state.get(f"code_analysis_{api_id}") or code_analyses.get(api_id)
+                if analysis_text:
+                    st.markdown("---")
+                    st.markdown("### Code Analysis")
                     
-                    with col4:
-                        if st.button("Remove API", key=f"remove_api_{api_id}"):
-                            app.remove_api(api_id)
-                            self.refresh_ui()
-
-                    with col5:
-                        if st.button("Clear Chat", key=f"clear_chat_{api_id}"):
-                            app.clear_chat_history(api_id)
-                            self.refresh_ui()                            
-
-                    # Display code analysis with properly formatted code snippets
-                    if f"code_analysis_{api_id}" in st.session_state:
-                        st.markdown("---")
-                        st.markdown("### Code Analysis")
-                        analysis_text = st.session_state[f"code_analysis_{api_id}"]
-                        
-                        # Use a container for better width control
-                        with st.container():
-                            st.markdown("""
-                            <style>
-                            .stMarkdown {
-                                max-width: 100%;
-                            }
-                            .stCodeBlock {
-                                max-width: 100%;
-                            }
-                            </style>
-                            """, unsafe_allow_html=True)
-                            
-                            self.format_code_snippets(analysis_text)
+                    # Use a container for better width control
+                    with st.container():
+                        st.markdown("""
+                        <style>
+                        .stMarkdown {
+                            max-width: 100%;
+                        }
+                        .stCodeBlock {
+                            max-width: 100%;
+                        }
+                        </style>
+                        """, unsafe_allow_html=True)
                         
-                        st.markdown("---")
-
-                    analysis_result = app.get_analysis_result(api_id)
-                    if analysis_result:
-                        st.subheader("Analysis Result")
-                        st.markdown(analysis_result)
-
-                    st.subheader("Chat")
-                    chat_history = app.get_chat_history(api_id)
-                    for message, is_user in chat_history:
-                        st.text(f"{'User' if is_user else 'AI'}: {message}")
-
-                    chat_input = st.text_input("Chat Input", key=f"chat_input_{api_id}")
-                    if st.button("Send", key=f"send_{api_id}"):
-                        response = app.chat(api_id, chat_input)
-                        st.markdown(f"AI: {response}")
-                        self.refresh_ui()
+                        self.format_code_snippets(analysis_text)
+                    
+                    st.markdown("---")
 
-        st.header("Important APIs")
-        important_apis = app.get_important_apis()
-        if not important_apis:
-            st.info("No APIs marked as important yet.")
-        else:
-            for api in important_apis:
-                st.write(f"#{api['id']}: {api['method']} {api['url']}")
+                if analyze_clicked:
+                    st.subheader("Analysis Result")
+                    st.write_stream(app.stream_analysis(api_id))
+                    st.rerun()
+
+                analysis_result = api.analysis_result
+                if analysis_result:
+                    st.subheader("Analysis Result")
+                    st.markdown(analysis_result)
+
+                st.subheader("Chat")
+                chat_history = chat_histories.get(api_id, [])
+                for message, is_user in chat_history:
+                    st.text(f"{'User' if is_user else 'AI'}: {message}")
+
+                chat_input = st.text_input("Chat Input", key=f"{key_prefix}chat_input_{api_id}")
+                if st.button("Send", key=f"{key_prefix}send_{api_id}"):
+                    st.text(f"User: {chat_input}")
+                    st.write_stream(app.stream_chat(api_id, chat_input))
+                    self.refresh_ui()
+
+    def endpoint_list(self, app):
+        endpoints = app.get_endpoints()
+        if not endpoints:
+            st.info("No endpoints captured yet. Start the proxy and make some requests to see data here.")
+            return
+        for endpoint in endpoints:
+            is_analyzed = endpoint.analysis_result is not None
+            icon = "✅" if is_analyzed else "🔄"
+            with st.expander(f"{icon} {endpoint.method} {endpoint.host}{endpoint.path_template} ({endpoint.hit_count} hits)", expanded=False):
+                if endpoint.param_shape:
+                    st.write(f"Parameters: {endpoint.param_shape}")
+                st.write(f"Last seen: {endpoint.last_seen}")
+                if not is_analyzed:
+                    if st.button("Analyze", key=f"analyze_endpoint_{endpoint.id}"):
+                        api_id = app.get_endpoint_sample(endpoint.id)
+                        if api_id is not None:
+                            st.subheader("Analysis Result")
+                            st.write_stream(app.stream_analysis(api_id))
+                        st.rerun()
+                else:
+                    st.subheader("Analysis Result")
+                    st.markdown(endpoint.analysis_result)
+
+    def finding_list(self, app):
+        counts = app.get_finding_counts()
+        if not counts:
+            st.info("No secrets or personal data detected in captured traffic yet.")
+            return
+        labels = {kind: f"{kind} ({severity}): {total} in {api_count} APIs" for kind, severity, total, api_count in counts}
+        kind = st.selectbox("Finding type", [None] + list(labels), key="finding_kind",
+                            format_func=lambda kind: "All" if kind is None else labels[kind])
+        for finding in app.get_findings(kind):
+            st.write(f"**{finding.kind}** ({finding.severity}) in {finding.location.replace('_', ' ')}: "
+                     f"`{finding.preview}` - #{finding.api_id} {finding.method} {finding.url}")
+        st.caption("Search with finding:<type> to open the affected API calls.")
 
     def refresh_ui(self):
         st.session_state.refresh_key += 1
\ No newline at end of file
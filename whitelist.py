@@ -0,0 +1,103 @@
+import re
+import time
+import logging
+from collections import OrderedDict
+
+WILDCARD = '*'
+
+
+class DomainMatcher:
+    def __init__(self, conn, reload_interval=1.0, cache_size=4096):
+        self.conn = conn
+        self.reload_interval = reload_interval
+        self.cache_size = cache_size
+        self.domains = []
+        self.exact = set()
+        self.suffix_trie = {}
+        self.pattern = None
+        self.cache = OrderedDict()
+        self.data_version = None
+        self.last_check = 0.0
+        self.reload(force=True)
+
+    def reload(self, force=False):
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA data_version")
+        data_version = cursor.fetchone()[0]
+        if not force and data_version == self.data_version:
+            return False
+        self.data_version = data_version
+        try:
+            cursor.execute("SELECT domain FROM whitelisted_domains")
+            domains = sorted(row[0].strip().lower() for row in cursor.fetchall() if row[0] and row[0].strip())
+        except Exception as e:
+            logging.error(f"Error loading whitelisted domains: {e}")
+            return False
+        if domains == self.domains and not force:
+            return False
+        self.compile(domains)
+        logging.info(f"Loaded {len(domains)} whitelisted domains")
+        return True
+
+    def compile(self, domains):
+        exact = set()
+        trie = {}
+        patterns = []
+        for domain in domains:
+            if WILDCARD not in domain:
+                exact.add(domain)
+            elif domain.startswith('*.') and WILDCARD not in domain[2:]:
+                # "*.example.com" -> one or more labels in front of example.com
+                node = trie
+                for label in reversed(domain[2:].split('.')):
+                    node = node.setdefault(label, {})
+                node[WILDCARD] = True
+            else:
+                patterns.append(re.escape(domain).replace('\\*', '.*'))
+        self.domains = domains
+        self.exact = exact
+        self.suffix_trie = trie
+        self.pattern = re.compile(f"^(?:{'|'.join(patterns)})$") if patterns else None
+        self.cache.clear()
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self.last_check < self.reload_interval:
+            return
+        self.last_check = now
+        self.reload()
+
+    def is_whitelisted(self, host):
+        self.maybe_reload()
+        host = host.lower()
+        cached = self.cache.get(host)
+        if cached is not None:
+            self.cache.move_to_end(host)
+            return cached
+        result = self.match(host)
+        self.cache[host] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def match(self, host):
+        if self.match_host(host):
+            return True
+        # Entries without a port still apply to hosts on non-default ports
+        name, sep, port = host.rpartition(':')
+        return bool(sep) and port.isdigit() and self.match_host(name)
+
+    def match_host(self, host):
+        if host in self.exact:
+            return True
+        labels = host.split('.')
+        node = self.suffix_trie
+        for depth, label in enumerate(reversed(labels)):
+            node = node.get(label)
+            if node is None:
+                break
+            if node.get(WILDCARD) and depth + 1 < len(labels):
+                return True
+        if self.pattern is not None:
+            return self.pattern.match(host) is not None
+        return False